@@ -0,0 +1,60 @@
+import argparse
+import csv
+import random
+import uuid
+from typing import Iterator, TextIO
+
+CURRENCIES = [
+    'AAVE', 'ADA', 'ALGO', 'ATOM', 'AVAX', 'AXS', 'BNB', 'BTC', 'BUSD', 'CAKE', 'DAI', 'DOGE', 'DOT', 'ENS', 'ETH', 'FTM',
+    'LUNA', 'LUNA2', 'MANA', 'MATIC', 'NEAR', 'PAXG', 'SAND', 'SHIB', 'SLP', 'SOL', 'TRX', 'UNI', 'USDC', 'USDT', 'UST'
+]
+
+# Number of integer digits of the generated amounts
+INTEGER_DIGITS = 6
+
+def get_currencies(currencies_count: int) -> list[str]:
+    return CURRENCIES[:currencies_count] + [f'C{i:04d}' for i in range(len(CURRENCIES), currencies_count)]
+
+'''
+    Yields the id and the stringified balances of users_count synthetic users, in the format of the input of main.py.
+    Every user lists all the currencies and each amount is zero with probability sparsity, otherwise it has up to
+    INTEGER_DIGITS integer digits and precision decimal digits (at most 8). The same seed always yields the same users.
+'''
+def generate_users(users_count: int, currencies_count: int, sparsity: float, precision: int, seed: int) -> Iterator[tuple[str, str]]:
+    rng = random.Random(seed)
+    currencies = get_currencies(currencies_count)
+    scale = 10 ** (8 - precision)
+
+    for _ in range(users_count):
+        id = str(uuid.UUID(int = rng.getrandbits(128), version = 4))
+
+        balances = []
+        for currency in currencies:
+            units = 0 if rng.random() < sparsity else rng.randrange(1, 10 ** (INTEGER_DIGITS + precision)) * scale
+            balances.append(f'{currency}:{units // 10 ** 8}.{units % 10 ** 8:08d}')
+
+        yield id, '|'.join(balances)
+
+def write_users(file: TextIO, users: Iterator[tuple[str, str]]) -> None:
+    writer = csv.writer(file)
+    writer.writerow(['id', 'balances'])
+    writer.writerows(users)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', help='Path of the generated input file', required = True)
+    parser.add_argument('-n', '--users', type=int, default=1000, help='Number of users')
+    parser.add_argument('-m', '--currencies', type=int, default=len(CURRENCIES), help='Number of currencies of each user')
+    parser.add_argument('--sparsity', type=float, default=0.8, help='Probability of a balance being zero')
+    parser.add_argument('--precision', type=int, default=8, choices=range(9), help='Number of decimals of the amounts')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generator')
+
+    args = parser.parse_args()
+
+    return args.output, args.users, args.currencies, args.sparsity, args.precision, args.seed
+
+if __name__ == '__main__':
+    output_path, users_count, currencies_count, sparsity, precision, seed = parse_arguments()
+
+    with open(output_path, 'w', newline='', encoding='utf-8') as file:
+        write_users(file, generate_users(users_count, currencies_count, sparsity, precision, seed))
@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import csv
+import json
+import random
+import time
+from urllib.parse import quote
+
+'''
+    Sends requests for the proofs of the given ids over one keep alive connection, taking the ids from the shared
+    iterator until it is exhausted, and records the latency of each request and the status of the failed ones.
+'''
+async def run_connection(host: str, port: int, ids, proof_format: str, latencies: list[float], failures: list[int]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        for id in ids:
+            start = time.perf_counter()
+            writer.write(f"GET /proof/{quote(id)}?format={proof_format} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+
+            head = await reader.readuntil(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            length = next(int(line.split(':', 1)[1]) for line in lines if line.lower().startswith('content-length:'))
+            await reader.readexactly(length)
+
+            latencies.append(time.perf_counter() - start)
+            status = int(lines[0].split(' ')[1])
+            if status != 200:
+                failures.append(status)
+    finally:
+        writer.close()
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+'''
+    Requests requests_count random proofs with connections_count concurrent connections and returns a summary
+    with the throughput and the latency percentiles in milliseconds.
+'''
+async def run_load_test(host: str, port: int, ids: list[str], requests_count: int, connections_count: int, proof_format: str, seed: int) -> dict:
+    rng = random.Random(seed)
+    requested_ids = iter([rng.choice(ids) for _ in range(requests_count)])
+    latencies, failures = [], []
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_connection(host, port, requested_ids, proof_format, latencies, failures) for _ in range(connections_count)
+    ])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return dict({
+        'requests': len(latencies),
+        'failed': len(failures),
+        'connections': connections_count,
+        'format': proof_format,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': { name: percentile(latencies, fraction) * 1000 for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)] }
+    })
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='Path of the input file of main.py, whose ids are requested', required = True)
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the proof service')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port of the proof service')
+    parser.add_argument('-n', '--requests', type=int, default=10000, help='Number of requests')
+    parser.add_argument('-c', '--connections', type=int, default=64, help='Number of concurrent connections')
+    parser.add_argument('--format', choices=['text', 'binary'], default='text', help='Format of the requested proofs')
+    parser.add_argument('--seed', type=int, default=0, help='Seed used to choose the requested ids')
+    parser.add_argument('-o', '--output', help='Path of a JSON file where the summary is written')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    with open(args.input, 'r') as file:
+        ids = [row['id'].strip() for row in csv.DictReader(file)]
+
+    summary = asyncio.run(run_load_test(args.host, args.port, ids, args.requests, args.connections, args.format, args.seed))
+    print(json.dumps(summary, indent = 4))
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(summary, file, indent = 4)
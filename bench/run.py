@@ -0,0 +1,131 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from lib.merkle import MerkleSumTree, verify_merkle_proof_from_leaf, proof_to_string
+from lib.metrics import get_peak_rss
+from main import read_user_balances
+from bench.generate import generate_users, write_users, CURRENCIES
+
+AUDIT_ID = 'bench-audit-id'
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+
+@contextmanager
+def timed(timings: dict[str, float], name: str):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+'''
+    Generates the input of users_count users and times each stage of main.py on it: building the tree,
+    checking its nodes, generating single proofs and every proof, writing the tree and proofs outputs,
+    saving and loading a snapshot and verifying single proofs. The single proofs are timed over the same
+    random sample of samples_count users. Runs in a fresh process so that the peak RSS belongs to this size.
+'''
+def run_size(users_count: int, currencies_count: int, sparsity: float, precision: int, seed: int, workers: int, samples_count: int) -> dict:
+    timings: dict[str, float] = dict()
+    random.seed(seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = os.path.join(directory, 'users.csv')
+
+        with timed(timings, 'generate'), open(input_path, 'w', newline='', encoding='utf-8') as file:
+            write_users(file, generate_users(users_count, currencies_count, sparsity, precision, seed))
+
+        with timed(timings, 'build'), open(input_path, 'r') as file:
+            user_ids: list[str] = []
+            tree = MerkleSumTree(read_user_balances(file, user_ids), salt = AUDIT_ID, workers = workers)
+
+        with timed(timings, 'verify_nodes'):
+            tree.verify_nodes()
+
+        sample = random.Random(seed).sample(user_ids, min(samples_count, users_count))
+
+        with timed(timings, 'get_proof'):
+            proofs = [tree.get_proof(id) for id in sample]
+
+        with timed(timings, 'iter_proofs'):
+            for _ in tree.iter_proofs():
+                pass
+
+        with timed(timings, 'write_tree'), open(os.path.join(directory, 'tree.csv'), 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            for node in tree.get_nodes():
+                writer.writerow(node.to_string().split(','))
+
+        with timed(timings, 'write_proofs'), open(os.path.join(directory, 'proofs.csv'), 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            for position, proof in tree.iter_proofs():
+                writer.writerow([user_ids[position], proof_to_string(proof)])
+
+        snapshot_path = os.path.join(directory, 'tree.bin')
+        with timed(timings, 'save_snapshot'):
+            tree.save(snapshot_path)
+
+        with timed(timings, 'load_snapshot'):
+            loaded_tree = MerkleSumTree.load(snapshot_path)
+            loaded_tree.get_root()
+
+        root_node = tree.get_root()
+        leaves = [tree.get_leaf(id) for id in sample]
+        with timed(timings, 'verify_proof'):
+            for proof, leaf in zip(proofs, leaves):
+                verify_merkle_proof_from_leaf(root_node, proof, leaf, tree.hash_type)
+
+        del loaded_tree
+
+    return dict({
+        'users': users_count,
+        'samples': len(sample),
+        'timings': timings,
+        'peak_rss_bytes': get_peak_rss()
+    })
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', help='Path of the JSON file where the results are written', required = True)
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Numbers of users to benchmark')
+    parser.add_argument('-m', '--currencies', type=int, default=len(CURRENCIES), help='Number of currencies of each user')
+    parser.add_argument('--sparsity', type=float, default=0.8, help='Probability of a balance being zero')
+    parser.add_argument('--precision', type=int, default=8, choices=range(9), help='Number of decimals of the amounts')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated users and of the shuffle of the leaves')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes used to build the tree')
+    parser.add_argument('--samples', type=int, default=1000, help='Number of users whose single proofs are generated and verified')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    results = []
+
+    for users_count in args.sizes:
+        # A spawned process starts without the memory of the previous sizes
+        with ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(
+                run_size, users_count, args.currencies, args.sparsity, args.precision, args.seed, args.workers, args.samples
+            ).result()
+
+        print(f"{users_count} users: " + ', '.join(f"{name} {seconds:.3f}s" for name, seconds in result['timings'].items()))
+        results.append(result)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(dict({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'parameters': dict({
+                'currencies': args.currencies,
+                'sparsity': args.sparsity,
+                'precision': args.precision,
+                'seed': args.seed,
+                'workers': args.workers
+            }),
+            'results': results
+        }), file, indent = 4)
@@ -0,0 +1,169 @@
+import re
+from decimal import Decimal
+from typing import Optional
+
+DECIMAL_PRECISION: int = 8
+
+# Rounded decimals can't have more digits than the precision of the default decimal context (28),
+# so amounts are limited to the same range they had when the balances were decimals.
+MAX_UNITS: int = 10 ** 28 - 1
+
+_UNITS_SCALE: int = 10 ** DECIMAL_PRECISION
+# Smallest amount whose rounded decimal is not stringified in scientific notation
+_PLAIN_MIN_UNITS: int = 10 ** (DECIMAL_PRECISION - 6)
+_PLAIN_FORMAT: str = f'%d.%0{DECIMAL_PRECISION}d'
+_CURRENCY_PLAIN_FORMAT: str = f'%s:{_PLAIN_FORMAT}'
+_PLAIN_AMOUNT = re.compile(r'([+-]?)([0-9]*)(?:\.([0-9]*))?')
+_ZERO_AMOUNTS = frozenset(['0', '0.' + '0' * DECIMAL_PRECISION, f'0E-{DECIMAL_PRECISION}'])
+
+'''
+    Integer balance engine. Amounts are handled as integers scaled by 10^DECIMAL_PRECISION (units) instead of
+    decimals, and they are turned into the exact same strings that the stringified decimal balances have, so the
+    hashes of the tree do not change.
+'''
+
+'''
+    Parses an amount into units rounding it to DECIMAL_PRECISION decimals with ROUND_HALF_EVEN, the same way
+    round(Decimal(amount), DECIMAL_PRECISION) does. Plain amounts are parsed without going through decimals.
+'''
+def parse_units(amount: str) -> int:
+    match = _PLAIN_AMOUNT.fullmatch(amount)
+    if match is None or not (match.group(2) or match.group(3)):
+        return _parse_units_decimal(amount)
+
+    sign, whole, fraction = match.group(1), match.group(2), match.group(3) or ''
+
+    units = int((whole or '0') + fraction[:DECIMAL_PRECISION].ljust(DECIMAL_PRECISION, '0'))
+
+    remainder = fraction[DECIMAL_PRECISION:]
+    if remainder:
+        first_digit, rest = remainder[0], remainder[1:].strip('0')
+        if first_digit > '5' or (first_digit == '5' and (rest or units % 2 == 1)):
+            units += 1
+
+    require_units_range(units)
+
+    return -units if sign == '-' else units
+
+def _parse_units_decimal(amount: str) -> int:
+    units = int(round(Decimal(amount), DECIMAL_PRECISION).scaleb(DECIMAL_PRECISION))
+    require_units_range(abs(units))
+
+    return units
+
+'''
+    Formats units as the string of the equivalent rounded decimal. Decimals with an exponent of
+    -DECIMAL_PRECISION use scientific notation when their adjusted exponent is lower than -6.
+'''
+def format_units(units: int) -> str:
+    if units >= _PLAIN_MIN_UNITS:
+        return _PLAIN_FORMAT % divmod(units, _UNITS_SCALE)
+
+    digits = str(units)
+    adjusted = len(digits) - 1 - DECIMAL_PRECISION
+
+    return f"{digits[0]}{'.' + digits[1:] if len(digits) > 1 else ''}E{adjusted}"
+
+'''
+    Decodes a balance string with the format 'currency_1:amount_1|...|currency_N:amount_N' into units.
+    Amounts are parsed exactly, a negative amount raises an exception and zero amounts are dropped,
+    since the lack of a currency implies a zero balance.
+'''
+def decode_balance_units(balance_str: str) -> dict[str, int]:
+    balances = dict()
+
+    # If the leaf has no balances then return an empty dict
+    if balance_str == '': return balances
+
+    for entry in balance_str.split('|'):
+        currency, separator, amount = entry.partition(':')
+        if separator == '': raise Exception(f"Invalid balance {entry}")
+
+        units = _decode_amount(amount)
+        if units is not None:
+            balances[currency] = units
+
+    return balances
+
+'''
+    Decodes a chunk of balance strings (see decode_balance_units) into one column per currency with the
+    units of each row, or None for the rows that do not hold that currency.
+'''
+def decode_balance_columns(balance_strs: list[str]) -> dict[str, list[Optional[int]]]:
+    columns = dict()
+    rows_count = len(balance_strs)
+
+    for row, balance_str in enumerate(balance_strs):
+        if balance_str == '': continue
+
+        for entry in balance_str.split('|'):
+            currency, separator, amount = entry.partition(':')
+            if separator == '': raise Exception(f"Invalid balance {entry}")
+
+            units = _decode_amount(amount)
+            if units is None: continue
+
+            column = columns.get(currency)
+            if column is None:
+                column = columns[currency] = [None] * rows_count
+
+            column[row] = units
+
+    return columns
+
+'''
+    Decodes the amount of a user balance into units, or None if it is zero. Zero and plain amounts with
+    DECIMAL_PRECISION decimals, which are most of them, are read with int, the rest go through parse_units.
+'''
+def _decode_amount(amount: str) -> Optional[int]:
+    if amount in _ZERO_AMOUNTS:
+        return None
+
+    whole, _, fraction = amount.partition('.')
+    if len(fraction) == DECIMAL_PRECISION and whole.isdecimal() and fraction.isdecimal():
+        units = int(whole + fraction)
+        require_units_range(units)
+        return units if units != 0 else None
+
+    units = parse_units(amount)
+    if units < 0:
+        raise Exception("User balance must be positive")
+
+    # Amounts that round to zero units are filtered as floats, as the balances always were: they are dropped
+    # if they are zero as a float, including those that underflow, and kept otherwise
+    if units == 0:
+        value = float(amount)
+        if value < 0: raise Exception("User balance must be positive")
+        if value == 0: return None
+
+    return units
+
+def parse_balance(balance_dict: dict[str, str]) -> dict[str, int]:
+    return { k: parse_units(v) for k, v in balance_dict.items() }
+
+'''
+    Stringifies the balances in units with the same format as merkle.to_string.
+'''
+def format_balance(balances: dict[str, int]) -> str:
+    return '|'.join([
+        _CURRENCY_PLAIN_FORMAT % (currency, amount // _UNITS_SCALE, amount % _UNITS_SCALE) if amount >= _PLAIN_MIN_UNITS
+        else f"{currency}:{format_units(amount)}"
+        for currency, amount in sorted(balances.items())
+    ])
+
+'''
+    Combines two balances in units by summing the amounts of each currency, a currency missing in one of
+    them counts as zero. Raises an exception if any amount overflows MAX_UNITS.
+'''
+def combine_units(left_balances: dict[str, int], right_balances: dict[str, int]) -> dict[str, int]:
+    balances = dict(left_balances)
+    for currency, amount in right_balances.items():
+        balances[currency] = balances.get(currency, 0) + amount
+
+    if len(balances) != 0:
+        require_units_range(max(balances.values()))
+
+    return balances
+
+def require_units_range(units: int):
+    if units > MAX_UNITS: raise Exception(f"Balance overflow: {units} units exceed the maximum of {MAX_UNITS}")
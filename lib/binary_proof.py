@@ -0,0 +1,166 @@
+import mmap
+from typing import BinaryIO, Iterable, Iterator
+from lib.errors import require
+
+BINARY_PROOF_VERSION: int = 1
+
+# Start of the files of binary proofs, followed by the version of their records
+PROOFS_FILE_MAGIC: bytes = b'POLP' + bytes([BINARY_PROOF_VERSION])
+
+'''
+    Binary format of a proof, where the counts and the amounts are unsigned LEB128 varints:
+
+        - The version and the size of the hashes, one byte each.
+        - The number of steps, followed by one bit per step (least significant first) which is set
+          when the sibling of the step is on the left.
+        - For each step, the raw hash of the sibling and its balances: a bitmap with one bit per currency of
+          the dictionary telling the currencies the sibling holds, followed by their amounts in units
+          (see lib/balance.py) in the order of the dictionary.
+
+    A currency held with a zero amount is kept apart from a missing currency, so a proof can be turned into
+    its text form and back without changes.
+'''
+
+class CurrencyDictionary():
+    '''
+        Sorted list of the currencies of an audit, which identifies each currency by its position. Every
+        currency of the tree is held by the root, so the currencies of the root balances form the dictionary.
+    '''
+    def __init__(self, currencies: Iterable[str]) -> None:
+        self.currencies = sorted(set(currencies))
+        self.ids = { currency: id for id, currency in enumerate(self.currencies) }
+        self.bitmap_size = (len(self.currencies) + 7) // 8
+
+    def encode_balances(self, balances: dict[str, int]) -> bytes:
+        bitmap = 0
+        amounts = bytearray()
+
+        for currency in sorted(balances, key = self._get_id):
+            bitmap |= 1 << self.ids[currency]
+            amounts += encode_varint(balances[currency])
+
+        return bitmap.to_bytes(self.bitmap_size, 'little') + amounts
+
+    '''
+        Decodes the balances that start at offset, returning them and the offset where they end.
+    '''
+    def decode_balances(self, data: bytes, offset: int) -> tuple[dict[str, int], int]:
+        bitmap = int.from_bytes(data[offset:offset + self.bitmap_size], 'little')
+        offset += self.bitmap_size
+
+        balances = dict()
+        id = 0
+        while bitmap:
+            if bitmap & 1:
+                balances[self.currencies[id]], offset = decode_varint(data, offset)
+            bitmap >>= 1
+            id += 1
+
+        return balances, offset
+
+    def _get_id(self, currency: str) -> int:
+        id = self.ids.get(currency)
+        require(id is not None, f"Currency {currency} is not in the dictionary")
+
+        return id
+
+def encode_varint(value: int) -> bytes:
+    require(value >= 0, "Only positive integers can be encoded")
+
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+'''
+    Decodes the varint that starts at offset, returning its value and the offset where it ends.
+'''
+def decode_varint(data: bytes, offset: int) -> tuple[int, int]:
+    value = shift = 0
+
+    try:
+        while True:
+            byte = data[offset]
+            value |= (byte & 0x7F) << shift
+            offset += 1
+            if byte < 0x80:
+                return value, offset
+            shift += 7
+    except IndexError:
+        raise Exception("Truncated binary proof")
+
+'''
+    Encodes the header of a proof given, for each step, whether its sibling is on the left.
+'''
+def encode_proof_header(left_sides: list[bool], hash_size: int) -> bytes:
+    sides = sum(1 << step for step, is_left in enumerate(left_sides) if is_left)
+
+    return (
+        bytes([BINARY_PROOF_VERSION, hash_size]) + encode_varint(len(left_sides)) +
+        sides.to_bytes((len(left_sides) + 7) // 8, 'little')
+    )
+
+'''
+    Decodes the header of a binary proof into the size of the hashes, the number of steps, the sides as
+    an integer with one bit per step and the offset where the steps start.
+'''
+def decode_proof_header(data: bytes) -> tuple[int, int, int, int]:
+    require(len(data) >= 2 and data[0] == BINARY_PROOF_VERSION, "Unsupported binary proof")
+
+    steps_count, offset = decode_varint(data, 2)
+    sides_size = (steps_count + 7) // 8
+
+    return data[1], steps_count, int.from_bytes(data[offset:offset + sides_size], 'little'), offset + sides_size
+
+'''
+    Yields the steps of a binary proof as a tuple of whether the sibling is on the left, its hash, its balances
+    in units and the offset where the step ends, so that data[offset:] holds the remaining steps.
+'''
+def iter_binary_proof(data: bytes, dictionary: CurrencyDictionary) -> Iterator[tuple[bool, bytes, dict[str, int], int]]:
+    hash_size, steps_count, sides, offset = decode_proof_header(data)
+
+    for step in range(steps_count):
+        hash = bytes(data[offset:offset + hash_size])
+        require(len(hash) == hash_size, "Truncated binary proof")
+
+        balances, offset = dictionary.decode_balances(data, offset + hash_size)
+        yield (sides >> step) & 1 == 1, hash, balances, offset
+
+    require(offset == len(data), "Unexpected data at the end of the binary proof")
+
+'''
+    Files of binary proofs, the proofs output of main.py with --proof-format binary, start with PROOFS_FILE_MAGIC
+    followed by one record per user: the length of the id and the id in utf-8, then the length of the proof and the
+    raw bytes of the proof, with the lengths as varints. The proofs are not encoded in base64, so the file is about
+    a third of the size of the text proofs.
+'''
+def encode_proof_record(id: str, proof: bytes) -> bytes:
+    encoded_id = str.encode(id)
+    return encode_varint(len(encoded_id)) + encoded_id + encode_varint(len(proof)) + proof
+
+'''
+    Decodes the record that starts at offset, returning the id, the proof and the offset where it ends.
+'''
+def decode_proof_record(data: bytes, offset: int) -> tuple[str, bytes, int]:
+    id_length, offset = decode_varint(data, offset)
+    id = bytes(data[offset:offset + id_length]).decode('utf-8')
+    proof_length, offset = decode_varint(data, offset + id_length)
+    proof = bytes(data[offset:offset + proof_length])
+    require(len(proof) == proof_length, "Truncated binary proofs file")
+
+    return id, proof, offset + proof_length
+
+'''
+    Yields the id and the binary proof of every record of a file of binary proofs.
+'''
+def iter_proofs_file(file: BinaryIO) -> Iterator[tuple[str, bytes]]:
+    require(file.read(len(PROOFS_FILE_MAGIC)) == PROOFS_FILE_MAGIC, "Unsupported binary proofs file")
+
+    with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+        offset = len(PROOFS_FILE_MAGIC)
+        while offset < len(data):
+            id, proof, offset = decode_proof_record(data, offset)
+            yield id, proof
@@ -0,0 +1,77 @@
+from typing import Iterator
+from lib.merkle import LeafBatch
+from lib.errors import require
+from lib.balance import require_units_range
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNAR_FORMATS = ['arrow', 'parquet']
+
+ID_COLUMN: str = 'id'
+
+'''
+    Columnar input of the leaves, as an Arrow IPC file (also known as Feather v2) or a Parquet file, which is read with
+    pyarrow if it is installed. The file has a string column with the ids of the users and one integer column per
+    currency, named after the currency, with the amounts in units (see lib/balance.py), that is multiplied by
+    10^DECIMAL_PRECISION, or null for the users that do not hold the currency.
+
+    The file is read in record batches which are turned into LeafBatches column by column, so the amounts are never
+    stringified nor parsed. A zero amount is dropped as a zero amount of the CSV input is, so both inputs give the same tree.
+'''
+
+'''
+    Reads the leaves of a columnar file of the given format (see COLUMNAR_FORMATS) in batches of at most chunk_size
+    rows, adding the ids of the users to user_ids in the same order as they are read.
+'''
+def read_columnar_balances(path: str, input_format: str, user_ids: list[str], chunk_size: int = 10000) -> Iterator[LeafBatch]:
+    require(pyarrow is not None, "pyarrow is required to read arrow or parquet input files")
+    require(input_format in COLUMNAR_FORMATS, f"Unknown columnar format {input_format}")
+
+    for batch in _iter_record_batches(path, input_format, chunk_size):
+        yield _to_leaf_batch(batch, user_ids)
+
+def _iter_record_batches(path: str, input_format: str, chunk_size: int) -> Iterator['pyarrow.RecordBatch']:
+    if input_format == 'parquet':
+        yield from pyarrow.parquet.ParquetFile(path).iter_batches(batch_size = chunk_size)
+        return
+
+    with pyarrow.memory_map(path) as source:
+        reader = pyarrow.ipc.open_file(source)
+
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            for offset in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(offset, chunk_size)
+
+def _to_leaf_batch(batch: 'pyarrow.RecordBatch', user_ids: list[str]) -> LeafBatch:
+    require(ID_COLUMN in batch.schema.names, f"The input has no {ID_COLUMN} column")
+
+    ids = batch.column(ID_COLUMN).to_pylist()
+    require(None not in ids, "The input has users without id")
+    ids = [id.strip() for id in ids]
+    user_ids.extend(ids)
+
+    balances = dict()
+    for field, column in zip(batch.schema, batch.columns):
+        if field.name == ID_COLUMN:
+            continue
+
+        require(pyarrow.types.is_integer(field.type), f"Column {field.name} must hold integer amounts")
+
+        column = pyarrow.compute.if_else(pyarrow.compute.equal(column, 0), None, column)
+        if column.null_count == len(column):
+            continue
+
+        bounds = pyarrow.compute.min_max(column).as_py()
+        if bounds['min'] < 0: raise Exception("User balance must be positive")
+        require_units_range(bounds['max'])
+
+        balances[field.name] = column.to_pylist()
+
+    return LeafBatch(ids, balances)
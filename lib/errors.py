@@ -0,0 +1,10 @@
+'''
+    Validation helper shared by the modules of lib. It has no dependencies, so any module can import it
+    without import cycles.
+'''
+
+'''
+    Raises an exception with the given message if the statement does not hold.
+'''
+def require(statement: bool, message: str):
+    if not statement: raise Exception(message)
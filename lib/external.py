@@ -0,0 +1,436 @@
+import hashlib
+import heapq
+import marshal
+import mmap
+import os
+import random
+import string
+import struct
+import tempfile
+from array import array
+from collections.abc import Sequence
+from contextlib import contextmanager
+from random import shuffle as random_shuffle
+from typing import BinaryIO, Iterable, Iterator, Optional, Union
+from lib.merkle import Leaf, LeafBatch, get_next_pow_2, get_empty_hashes, hash_children
+from lib.snapshot import write_snapshot_sections, NARROW_WIDTH, WIDE_WIDTH
+from lib.storage import ABSENT, level_size
+from lib.balance import parse_balance, format_balance, combine_units
+from lib.metrics import Metrics, HashCounter, phase
+from lib.errors import require
+
+# Number of leaves sorted in memory at once to find duplicates and sort the slots by hash
+RUN_SIZE: int = 2 ** 20
+
+# Number of amounts of each column kept in memory before they are written
+COLUMN_CHUNK_SIZE: int = 2 ** 16
+
+# Bytes read at once from the spill files
+READ_SIZE: int = 2 ** 20
+
+# Length of the balances of a node in a level file
+_RECORD_LENGTH = struct.Struct('<I')
+_POSITION = struct.Struct('<q')
+_ID_RANGE = struct.Struct('<qq')
+
+'''
+    Out of core build of a merkle sum tree. The tree is built into a snapshot file (see lib/snapshot.py) with
+    the same nodes, positions and layout that MerkleSumTree.save writes, but without keeping the tree in memory,
+    so trees larger than the memory of the machine can be built. The snapshot is then loaded with MerkleSumTree.load,
+    which maps it and reads the nodes when they are requested, so proofs are extracted from the file: iter_proofs
+    reads the siblings of each level sequentially.
+
+    The build streams every level through files in a spill directory:
+
+        - The leaves are hashed as they are read and appended to a file in input order, with the offset of each
+          leaf in another file. The hashes and input positions are sorted in runs of RUN_SIZE leaves.
+        - The leaf positions are shuffled in a memory mapped file, the runs are merged to sort the slots by hash,
+          which finds the duplicated leaves, and the leaves are read in the order of the slots.
+        - Each level is read sequentially, two nodes at a time, to write the file of the level above, while its
+          hashes and amounts are appended to the sections of the snapshot.
+
+    Only a constant number of buffers (one per run, per currency and per level being read or written) are kept in
+    memory. Balances are kept in the level files with marshal, since they are only read back by the same build.
+'''
+
+'''
+    Builds the tree of the given leaves as MerkleSumTree does and writes its snapshot into path. The spill files
+    are written in a temporary directory inside directory, or in the default temporary directory if it is None,
+    which needs about as much free space as the snapshot. With the same leaves, salt and state of the random
+    module the snapshot is the same one that the in-memory tree saves.
+
+    If metrics are given the time spent hashing the leaves, sorting them, building the levels and writing the
+    snapshot is added to them, together with the number of leaves, hashes and bytes hashed.
+'''
+def build_snapshot(
+    leaves: Iterable[Union[Leaf, LeafBatch]],
+    path: str,
+    hash_type: str = 'sha256',
+    salt: str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=100)),
+    shuffle = True,
+    directory: Optional[str] = None,
+    metrics: Optional[Metrics] = None
+) -> None:
+    hash_function = getattr(hashlib, hash_type)
+    hash_size = hash_function().digest_size
+    if metrics is not None:
+        hash_function = HashCounter(hash_function)
+
+    with tempfile.TemporaryDirectory(dir = directory) as spill_directory:
+        spill = lambda name: os.path.join(spill_directory, name)
+
+        with phase(metrics, 'hash_leaves'):
+            leaves_count, currencies, runs = _spill_leaves(leaves, hash_function, salt, spill, metrics)
+
+        height = get_next_pow_2(leaves_count).bit_length() - 1
+        total_leaves = 1 << height
+
+        with phase(metrics, 'sort_leaves'):
+            _write_array(spill('positions.bin'), range(leaves_count))
+            _write_array(spill('slots.bin'), [], leaves_count)
+
+            with _mapped_array(spill('positions.bin'), leaves_count) as positions:
+                # Only the leaves are shuffled, the empty leaves stay at the end of the last level
+                if shuffle == True:
+                    random_shuffle(positions)
+
+                with _mapped_array(spill('slots.bin'), leaves_count) as slots:
+                    for slot, position in enumerate(positions):
+                        slots[position] = slot
+
+            _sort_slots(runs, hash_size, total_leaves, spill('slots.bin'), spill('sorted_slots.bin'))
+
+        with phase(metrics, 'build'):
+            columns = _ColumnSpill(currencies, spill)
+            with open(spill('hashes.bin'), 'wb') as hashes_file:
+                _build_levels(
+                    _iter_gathered_leaves(spill, leaves_count, hash_size), leaves_count, height,
+                    get_empty_hashes(hash_function, height), hash_function, hash_size, hashes_file, columns, spill
+                )
+            columns.close()
+
+        with phase(metrics, 'write_snapshot'), open(path, 'wb') as file:
+            write_snapshot_sections(
+                file, hash_type, salt, hash_size, height, leaves_count, leaves_count, list(zip(currencies, columns.widths)),
+                _read_chunks(spill('hashes.bin')), _read_chunks(spill('positions.bin')), _read_chunks(spill('sorted_slots.bin')),
+                lambda currency, _: _read_chunks(columns.paths[currencies.index(currency)])
+            )
+
+    if metrics is not None:
+        metrics.count('leaves', leaves_count)
+        metrics.count('hashes', hash_function.calls)
+        metrics.count('hashed_bytes', hash_function.bytes)
+
+class SpilledIds(Sequence):
+    '''
+        The ids of the users in the order they are read, kept in a temporary file of directory instead of in memory,
+        so the out of core build does not hold every id while the proofs are written. Ids are appended with extend,
+        as to the list given to main.read_user_balances, with the offset where each one ends in another file. Once
+        they are read both files are mapped and every id is read by its position.
+    '''
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self._ids = tempfile.TemporaryFile(dir = directory)
+        self._offsets = tempfile.TemporaryFile(dir = directory)
+        self._offsets.write(_POSITION.pack(0))
+        self._count = self._offset = 0
+        self._mapped: Optional[tuple] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def extend(self, ids: Iterable[str]) -> None:
+        require(self._mapped is None, "Ids cannot be added once they are read")
+
+        offsets = array('q')
+        for id in ids:
+            encoded = str.encode(id)
+            self._ids.write(encoded)
+            self._offset += len(encoded)
+            offsets.append(self._offset)
+
+        self._offsets.write(offsets.tobytes())
+        self._count += len(offsets)
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+
+        ids, offsets = self._map()
+        start, end = _ID_RANGE.unpack_from(offsets, position * _POSITION.size)
+        return ids[start:end].decode('utf-8')
+
+    def _map(self) -> tuple:
+        if self._mapped is None:
+            self._ids.flush()
+            self._offsets.flush()
+            ids = mmap.mmap(self._ids.fileno(), 0, access = mmap.ACCESS_READ) if self._offset > 0 else b''
+            self._mapped = ids, mmap.mmap(self._offsets.fileno(), 0, access = mmap.ACCESS_READ)
+
+        return self._mapped
+
+    def close(self) -> None:
+        if self._mapped is not None:
+            for data in self._mapped:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+
+        self._ids.close()
+        self._offsets.close()
+
+'''
+    Hashes the leaves and appends them to the leaves file in input order, with the offset of each leaf in the
+    offsets file, validating their balances as MerkleSumTree does. Returns the number of leaves, the sorted
+    currencies of the leaves and the paths of the sorted runs of hashes and input positions.
+'''
+def _spill_leaves(leaves: Iterable[Union[Leaf, LeafBatch]], hash_function, salt: str, spill, metrics: Optional[Metrics]) -> tuple[int, list[str], list[str]]:
+    currencies = set()
+    runs: list[str] = []
+    run: list[tuple[bytes, int]] = []
+    offsets = array('q', [0])
+    offset = leaves_count = 0
+
+    with open(spill('leaves.bin'), 'wb') as leaves_file, open(spill('offsets.bin'), 'wb') as offsets_file:
+        for id, balances in _iter_leaf_balances(leaves, metrics):
+            hash = hash_function(str.encode(salt + id)).digest()
+            require(all(amount >= 0 for amount in balances.values()), "All balances must be positive")
+            currencies.update(balances)
+
+            record = _encode_record(hash, balances)
+            leaves_file.write(record)
+            offset += len(record)
+            offsets.append(offset)
+            run.append((hash, leaves_count))
+            leaves_count += 1
+
+            if len(offsets) >= COLUMN_CHUNK_SIZE:
+                offsets_file.write(offsets.tobytes())
+                del offsets[:]
+
+            if len(run) >= RUN_SIZE:
+                runs.append(_write_run(run, spill(f'run-{len(runs)}.bin')))
+
+        offsets_file.write(offsets.tobytes())
+
+    if len(run) != 0:
+        runs.append(_write_run(run, spill(f'run-{len(runs)}.bin')))
+
+    return leaves_count, sorted(currencies), runs
+
+def _iter_leaf_balances(leaves: Iterable[Union[Leaf, LeafBatch]], metrics: Optional[Metrics]) -> Iterator[tuple[str, dict[str, int]]]:
+    for leaf in leaves:
+        if isinstance(leaf, LeafBatch):
+            columns = list(leaf.balances.items())
+            for row, id in enumerate(leaf.ids):
+                yield id, { currency: amounts[row] for currency, amounts in columns if amounts[row] is not None }
+        else:
+            yield leaf.id, parse_balance(leaf.balances)
+
+        if metrics is not None:
+            metrics.advance('hash_leaves', len(leaf.ids) if isinstance(leaf, LeafBatch) else 1)
+
+def _write_run(run: list[tuple[bytes, int]], path: str) -> str:
+    run.sort()
+    with open(path, 'wb') as file:
+        file.write(b''.join([hash + _POSITION.pack(position) for hash, position in run]))
+
+    run.clear()
+    return path
+
+def _iter_run(path: str, hash_size: int) -> Iterator[tuple[bytes, int]]:
+    record_size = hash_size + _POSITION.size
+    for chunk in _read_chunks(path, READ_SIZE // record_size * record_size):
+        for offset in range(0, len(chunk), record_size):
+            yield chunk[offset:offset + hash_size], _POSITION.unpack_from(chunk, offset + hash_size)[0]
+
+'''
+    Merges the runs into the slots of the leaves sorted by hash, as indexes of the tree, rejecting repeated hashes.
+'''
+def _sort_slots(runs: list[str], hash_size: int, total_leaves: int, slots_path: str, path: str) -> None:
+    with _mapped_array(slots_path, os.path.getsize(slots_path) // _POSITION.size) as slots, open(path, 'wb') as file:
+        sorted_slots = array('q')
+        previous = None
+
+        for hash, position in heapq.merge(*[_iter_run(run, hash_size) for run in runs]):
+            require(hash != previous, f"Duplicate leaf with hash {hash.hex()}")
+            previous = hash
+
+            sorted_slots.append(total_leaves + slots[position])
+            if len(sorted_slots) >= COLUMN_CHUNK_SIZE:
+                file.write(sorted_slots.tobytes())
+                del sorted_slots[:]
+
+        file.write(sorted_slots.tobytes())
+
+'''
+    Yields the hash and balances of the leaves in the order of the slots, reading the leaves file at the offset
+    of the position of each slot.
+'''
+def _iter_gathered_leaves(spill, leaves_count: int, hash_size: int) -> Iterator[tuple[bytes, dict[str, int]]]:
+    if leaves_count == 0:
+        return
+
+    with _mapped_array(spill('positions.bin'), leaves_count) as positions, \
+        _mapped_array(spill('offsets.bin'), leaves_count + 1) as offsets, \
+        open(spill('leaves.bin'), 'rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+
+        for position in positions:
+            yield _decode_record(data, offsets[position], hash_size)[:2]
+
+'''
+    Writes the hashes and amounts of every level, from the given nodes of the leaves to the root. Each level is
+    read once, two nodes at a time, and its parents are written into the file of the next level, which is read
+    in turn. As in _build_internal_nodes, the last node of a level may have an empty right sibling.
+'''
+def _build_levels(
+    nodes: Iterator[tuple[bytes, dict[str, int]]], leaves_count: int, height: int, empty_hashes: list[bytes],
+    hash_function, hash_size: int, hashes_file: BinaryIO, columns: '_ColumnSpill', spill
+) -> None:
+    for level in range(height + 1):
+        level_path = spill(f'level-{level + 1}.bin')
+        with open(level_path, 'wb') if level < height else _null_file() as level_file:
+            left = None
+
+            for hash, balances in nodes:
+                hashes_file.write(hash)
+                columns.append(balances)
+
+                if left is None:
+                    left = hash, balances
+                    continue
+
+                left_hash, left_balances = left
+                level_file.write(_encode_record(
+                    hash_children(hash_function, left_hash, format_balance(left_balances), hash, format_balance(balances)),
+                    combine_units(left_balances, balances)
+                ))
+                left = None
+
+            if left is not None and level < height:
+                left_hash, left_balances = left
+                level_file.write(_encode_record(
+                    hash_children(hash_function, left_hash, format_balance(left_balances), empty_hashes[level], ''),
+                    left_balances
+                ))
+
+        if level > 0:
+            os.remove(spill(f'level-{level}.bin'))
+
+        if level < height:
+            nodes = _iter_records(level_path, level_size(leaves_count, level + 1), hash_size)
+
+def _encode_record(hash: bytes, balances: dict[str, int]) -> bytes:
+    encoded = marshal.dumps(balances)
+    return hash + _RECORD_LENGTH.pack(len(encoded)) + encoded
+
+'''
+    Decodes the record at offset, returning its hash, its balances and the offset where it ends.
+'''
+def _decode_record(data, offset: int, hash_size: int) -> tuple[bytes, dict[str, int], int]:
+    start = offset + hash_size + _RECORD_LENGTH.size
+    end = start + _RECORD_LENGTH.unpack_from(data, offset + hash_size)[0]
+
+    return bytes(data[offset:offset + hash_size]), marshal.loads(data[start:end]), end
+
+def _iter_records(path: str, count: int, hash_size: int) -> Iterator[tuple[bytes, dict[str, int]]]:
+    if count == 0:
+        return
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+        offset = 0
+        for _ in range(count):
+            hash, balances, offset = _decode_record(data, offset, hash_size)
+            yield hash, balances
+
+class _ColumnSpill():
+    '''
+        One file per currency with the amount of every node appended so far, or ABSENT for the nodes that do not
+        hold the currency. Amounts are written as 64 bit integers until one of a column does not fit, then the
+        whole column is rewritten with 128 bit integers, as the columns of a snapshot.
+    '''
+    def __init__(self, currencies: list[str], spill) -> None:
+        self.currencies = currencies
+        self.paths = [spill(f'column-{id}.bin') for id in range(len(currencies))]
+        self.widths = [NARROW_WIDTH] * len(currencies)
+        self._files = [open(path, 'wb') for path in self.paths]
+        self._pending: list[list[int]] = [[] for _ in currencies]
+        self._pending_count = 0
+
+    def append(self, balances: dict[str, int]) -> None:
+        for currency, pending in zip(self.currencies, self._pending):
+            pending.append(balances.get(currency, ABSENT))
+
+        self._pending_count += 1
+        if self._pending_count >= COLUMN_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        for id, pending in enumerate(self._pending):
+            if self.widths[id] == NARROW_WIDTH:
+                try:
+                    self._files[id].write(array('q', pending).tobytes())
+                except OverflowError:
+                    self._widen(id)
+
+            if self.widths[id] == WIDE_WIDTH:
+                self._files[id].write(b''.join([amount.to_bytes(WIDE_WIDTH, 'little', signed = True) for amount in pending]))
+
+            pending.clear()
+
+        self._pending_count = 0
+
+    def close(self) -> None:
+        self.flush()
+        for file in self._files:
+            file.close()
+
+    def _widen(self, id: int) -> None:
+        self._files[id].close()
+        narrow_path = self.paths[id] + '.narrow'
+        os.replace(self.paths[id], narrow_path)
+
+        self._files[id] = open(self.paths[id], 'wb')
+        for chunk in _read_chunks(narrow_path):
+            self._files[id].write(b''.join([amount.to_bytes(WIDE_WIDTH, 'little', signed = True) for amount in array('q', chunk)]))
+
+        os.remove(narrow_path)
+        self.widths[id] = WIDE_WIDTH
+
+def _read_chunks(path: str, size: int = READ_SIZE) -> Iterator[bytes]:
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(size)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+def _write_array(path: str, values: Iterable[int], zeros: int = 0) -> None:
+    with open(path, 'wb') as file:
+        chunk = array('q')
+        for value in values:
+            chunk.append(value)
+            if len(chunk) >= COLUMN_CHUNK_SIZE:
+                file.write(chunk.tobytes())
+                del chunk[:]
+
+        file.write(chunk.tobytes())
+        file.truncate(file.tell() + zeros * _POSITION.size)
+
+'''
+    Maps a file of count 64 bit integers as a writable sequence.
+'''
+@contextmanager
+def _mapped_array(path: str, count: int):
+    if count == 0:
+        yield array('q')
+        return
+
+    with open(path, 'r+b') as file, mmap.mmap(file.fileno(), count * _POSITION.size) as data:
+        view = memoryview(data).cast('q')
+        try:
+            yield view
+        finally:
+            view.release()
+
+@contextmanager
+def _null_file():
+    yield None
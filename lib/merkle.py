@@ -1,13 +1,25 @@
 import hashlib
-import math
 from decimal import Decimal
 from random import shuffle as random_shuffle
 from enum import Enum
 from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional, Union
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from collections import deque
+from collections.abc import Sequence
+from bisect import bisect_right
+from itertools import accumulate
+from lib.storage import NodeStore, TreeStore, EncodingCache, ABSENT, to_column_values
+from lib.errors import require
+from lib.snapshot import LeafIndex, write_snapshot, read_snapshot
+from lib.balance import DECIMAL_PRECISION, parse_balance, format_balance, combine_units
+from lib.metrics import Metrics, HashCounter, phase
+from lib.binary_proof import CurrencyDictionary, encode_proof_header, iter_binary_proof
 import string
 import random 
 
-DECIMAL_PRECISION: int = 8
 EMPTY_NODE_HASH: bytes = b'\x00' * 32
 
 class Side(str, Enum):
@@ -19,6 +31,40 @@ class Leaf:
     id: str
     balances: dict[str, str]
 
+'''
+    A chunk of leaves given as columns: the ids of the leaves and, for each currency, the amounts of
+    every leaf as integers scaled by 10^DECIMAL_PRECISION or None if the leaf does not hold the currency.
+'''
+@dataclass
+class LeafBatch:
+    ids: list[str]
+    balances: dict[str, list[Optional[int]]]
+
+'''
+    Nodes changed by an update of the leaves of a tree (see MerkleSumTree.update_leaves): dirty_nodes holds
+    the indexes of every recomputed node, the changed leaves included, and new_leaves the slots that hold
+    an inserted leaf or a leaf that was moved to another slot.
+'''
+@dataclass
+class TreeUpdate:
+    dirty_nodes: set[int]
+    new_leaves: set[int]
+
+    '''
+        Tells if the proof of the leaf in the given slot changed, that is if the leaf is new or one of the
+        siblings in its path to the root was recomputed.
+    '''
+    def is_proof_stale(self, slot: int) -> bool:
+        if slot in self.new_leaves:
+            return True
+
+        while slot > 1:
+            if slot ^ 1 in self.dirty_nodes:
+                return True
+            slot //= 2
+
+        return False
+
 
 class Node():
     hash: bytes
@@ -29,34 +75,76 @@ class Node():
         The dictionary consists of keys which represent currencies and decimals representing the corresponding amounts.
         The supplied Decimal values MUST be rounded up to 8 decimal values using ROUND_HALF_EVEN and must be positive.
     '''
-    def __init__(self, hash: bytes, balance_dict: dict[str, Decimal]) -> None:
+    def __init__(self, hash: bytes, balance_dict: dict[str, Decimal], encoded_balances: Optional[str] = None) -> None:
         self.hash = hash
         require(all(amount >= 0 for amount in balance_dict.values()), "All balances must be positive")
         self.balances = balance_dict
+        self._encoded_balances = encoded_balances
+
+    '''
+        Returns the stringified balances (see to_string). They are computed once, unless they were
+        already supplied when the node was created.
+    '''
+    def encode_balances(self) -> str:
+        if self._encoded_balances is None:
+            self._encoded_balances = to_string(self.balances)
+
+        return self._encoded_balances
 
     def to_string(self) -> str:
-        return f"{self.hash.hex()},{to_string(self.balances)}"
+        return f"{self.hash.hex()},{self.encode_balances()}"
 
 class ProofStep():
     side: Side
     hash: bytes
     balances: dict[str, Decimal]
 
-    def __init__(self, side: Side, hash: bytes, balances: dict[str, Decimal]) -> None:
+    '''
+        Creates a step of a proof. Steps are shared between the proofs that have the same sibling, so
+        they must not be modified and their string is only computed once. The stringified balances can
+        be supplied if they are already known.
+    '''
+    def __init__(self, side: Side, hash: bytes, balances: dict[str, Decimal], encoded_balances: Optional[str] = None) -> None:
         self.side = side
         self.hash = hash 
         self.balances = balances
+        self._encoded_balances = encoded_balances
+        self._string = None
+        self._bytes = None
+
+    def encode_balances(self) -> str:
+        if self._encoded_balances is None:
+            self._encoded_balances = to_string(self.balances)
+
+        return self._encoded_balances
 
     def to_string(self) -> str:
-        return f'{self.side},{self.hash.hex()},{to_string(self.balances)}'
+        if self._string is None:
+            self._string = f'{self.side.value},{self.hash.hex()},{self.encode_balances()}'
+
+        return self._string
+
+    '''
+        Encodes the hash and the balances of the step in the binary proof format (see lib/binary_proof.py),
+        the side is encoded with the rest of the sides of the proof. The bytes are computed once, so a
+        step must always be encoded with the same dictionary.
+    '''
+    def to_bytes(self, dictionary: CurrencyDictionary) -> bytes:
+        if self._bytes is None:
+            self._bytes = self.hash + dictionary.encode_balances(to_units_balance(self.balances))
+
+        return self._bytes
 
 class MerkleSumTree():
-    tree: list[Node]
-    leaves_map: dict[str, int]
+    tree: TreeStore
+    leaves_map: dict[bytes, int]
+    leaf_positions: array
+    positions_count: int
     salt: str
 
     '''
-        Builds a merkle sum tree given a list of tuples representing the tree leaves.
+        Builds a merkle sum tree given an iterable of leaves or batches of leaves, which is consumed only once
+        so the leaves can be streamed. The leaves are validated as they are read, and a leaf with a repeated id is rejected.
         Expects leaves to have length of a multiple of 2 and to be a list of tuples. If this is not true
         then empty nodes (with an EMPTY_NODE_HASH and an empty dictionary) will be used as leaves until
         a multiple of 2 is reached.
@@ -71,42 +159,308 @@ class MerkleSumTree():
             - The balances are ordered alphabetically by curency.
             - The amounts are required to have 8 decimals with a HALF_EVEN rounding mode applied.
 
-        The tree is internally stored as a flat list where node i is the parent of nodes 2i and 2i+1.
+        The tree is internally addressed as a flat list where node i is the parent of nodes 2i and 2i+1.
+        The empty leaves are always at the end of the last level, so every node above only empty leaves
+        is an empty node which only depends on its height. Those nodes are not stored nor hashed: the
+        TreeStore keeps the rest of the nodes in one columnar NodeStore per level and the hash of the empty
+        node of each height is computed once. Node objects are only created when they are requested.
+        The stringified balances of the nodes of the top levels are kept in an EncodingCache, so they are shared
+        by the hashing, the proofs and the output of the nodes.
+        For each leaf of the last level, from left to right, leaf_positions holds its position in the supplied
+        leaves, and positions_count is the number of positions given so far.
+
+        The leaves can be updated, inserted into empty leaves or removed afterwards, which only recomputes
+        the nodes in the paths from the changed leaves to the root.
+
+        When workers is greater than one the ids of the batches of leaves are hashed in a process pool as they
+        are read, then the leaves are split into a power of two number of subtrees which are built in the same
+        pool, and the top of the tree is built by combining the subtree roots. The resulting tree is exactly the
+        same as the one built with a single worker.
+
+        If metrics are given (see lib/metrics.py), the time spent hashing the leaves and building the nodes is
+        added to them, together with the number of hashes, the bytes hashed and the number of nodes of each level.
     '''
     def __init__(
         self, 
-        leaves: list[Leaf], 
+        leaves: Iterable[Union[Leaf, LeafBatch]], 
         hash_type: str = 'sha256', 
         salt: str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=100)),
-        shuffle = True
+        shuffle = True,
+        workers: int = 1,
+        metrics: Optional[Metrics] = None
     ) -> None:
         self.hash_function = getattr(hashlib, hash_type)
-        total_leaves = get_next_pow_2(len(leaves))
+        self.hash_type = hash_type
+        self.salt = salt
+        self.shuffle = shuffle
+        self.leaves_map = dict()
 
-        node_leaves = (
-            # Each leaf is a tuple (audit_id:user_id, balance_dict)
-            [Node(self.hash_function(str.encode(salt + leaf.id)).digest(), to_decimal_balance(leaf.balances)) for leaf in leaves] +
-            [Node(EMPTY_NODE_HASH, dict()) for _ in range(total_leaves - len(leaves))]
-        )
+        # The leaves are consumed as they come, hashed and stored in input order. Until the tree
+        # is built the leaves map holds the input position of each leaf.
+        leaf_store = NodeStore(0, self.hash_function().digest_size)
+        hash_function = self.hash_function if metrics is None else HashCounter(self.hash_function)
+        executor = ProcessPoolExecutor(max_workers = workers) if workers > 1 else None
 
-        if shuffle == True:
-            random_shuffle(node_leaves)
+        with executor if executor is not None else nullcontext():
+            self._build(leaves, leaf_store, hash_function, executor, workers, metrics)
 
-        tree = (
-            [None] * len(node_leaves) + node_leaves
-        )
+    def _build(
+        self, leaves: Iterable[Union[Leaf, LeafBatch]], leaf_store: NodeStore, hash_function,
+        executor: Optional[ProcessPoolExecutor], workers: int, metrics: Optional[Metrics]
+    ) -> None:
+        for leaf, encoded in _iter_encoded_leaves(leaves, self.hash_type, self.salt, executor, workers):
+            with phase(metrics, 'hash_leaves'):
+                if isinstance(leaf, LeafBatch):
+                    if encoded is None:
+                        encoded = _encode_leaf_batch(hash_function, self.salt, leaf.ids, leaf.balances)
+                    elif isinstance(hash_function, HashCounter):
+                        hash_function.calls += len(leaf.ids)
+                        hash_function.bytes += encoded[1]
 
-        self.leaves_map = dict()
-        for i in range(len(node_leaves), len(tree)):
-            hash = tree[i].hash
-            if hash != b'\x00' * 32:
-                self.leaves_map[hash] = i
+                    self._add_leaf_batch(leaf_store, leaf.ids, encoded[0], encoded[2])
+                else:
+                    self._add_leaf(leaf_store, leaf, hash_function)
+
+            if metrics is not None:
+                metrics.advance('hash_leaves', len(leaf.ids) if isinstance(leaf, LeafBatch) else 1)
+
+        leaves_count = len(leaf_store)
+        total_leaves = get_next_pow_2(leaves_count)
+        height = total_leaves.bit_length() - 1
+
+        # Only the leaves are shuffled, the empty leaves stay at the end of the last level
+        positions = array('q', range(leaves_count))
+
+        if self.shuffle == True:
+            random_shuffle(positions)
+
+        tree = TreeStore(height, leaves_count, get_empty_hashes(hash_function, height), leaf_store.hash_size)
+        tree.levels[0].gather_from(leaf_store, positions, 0)
+
+        for slot, position in enumerate(positions):
+            self.leaves_map[leaf_store.get_hash(position)] = total_leaves + slot
+
+        del leaf_store
+        self.leaf_positions = positions
+        self.positions_count = leaves_count
 
-        for i in range(len(node_leaves) - 1, 0, -1):
-            tree[i] = self._combine_tree_nodes(tree[2*i], tree[2*i+1])
+        self.encodings = EncodingCache()
+
+        with phase(metrics, 'build'):
+            if executor is not None and leaves_count > 1:
+                _build_tree_parallel(tree, self.hash_type, executor, workers, self.encodings, hash_function)
+                # The workers are joined here so that their CPU time is added to this phase
+                executor.shutdown()
+            else:
+                _build_internal_nodes(tree, hash_function, self.encodings)
 
         self.tree = tree
-        self.salt = salt
+
+        if metrics is not None:
+            metrics.count('leaves', leaves_count)
+            metrics.count('hashes', hash_function.calls)
+            metrics.count('hashed_bytes', hash_function.bytes)
+            metrics.values['nodes_per_level'] = [len(level) for level in tree.levels]
+
+    '''
+        Hashes a leaf and appends it to the store of the leaves, validating that its balances are
+        positive and that no other leaf with the same id was added before.
+    '''
+    def _add_leaf(self, leaf_store: NodeStore, leaf: Leaf, hash_function) -> None:
+        hash = hash_function(str.encode(self.salt + leaf.id)).digest()
+        require(hash not in self.leaves_map, f"Duplicate leaf with id {leaf.id}")
+
+        balances = parse_balance(leaf.balances)
+        require(all(amount >= 0 for amount in balances.values()), "All balances must be positive")
+
+        position = len(leaf_store)
+        leaf_store.grow(1)
+
+        leaf_store.set_hash(position, hash)
+        leaf_store.set_balances(position, balances)
+        self.leaves_map[hash] = position
+
+    '''
+        Appends a batch of leaves to the store of the leaves given the concatenated hashes of their ids and
+        their columns of balances, as _encode_leaf_batch gives them, checking that no other leaf with the
+        same id was added before.
+    '''
+    def _add_leaf_batch(self, leaf_store: NodeStore, ids: list[str], hashes: bytes, columns: dict[str, Union[array, list[int]]]) -> None:
+        start = len(leaf_store)
+        hash_size = leaf_store.hash_size
+        hash_list = [hashes[offset:offset + hash_size] for offset in range(0, len(hashes), hash_size)]
+
+        if not self.leaves_map.keys().isdisjoint(hash_list) or len(set(hash_list)) != len(hash_list):
+            seen = set()
+            for id, hash in zip(ids, hash_list):
+                require(hash not in self.leaves_map and hash not in seen, f"Duplicate leaf with id {id}")
+                seen.add(hash)
+
+        leaf_store.grow(len(ids))
+        leaf_store.hashes[start * hash_size:len(leaf_store) * hash_size] = hashes
+        self.leaves_map.update(zip(hash_list, range(start, len(leaf_store))))
+
+        for currency, values in columns.items():
+            leaf_store.set_values(currency, start, values)
+
+    '''
+        Replaces the balances of existing leaves given a map from id to the new balances, and recomputes
+        the nodes in the paths from those leaves to the root. Returns the nodes that changed.
+    '''
+    def update_leaves(self, balances_by_id: dict[str, dict[str, str]]) -> TreeUpdate:
+        updates = []
+        for id, balance_dict in balances_by_id.items():
+            slot = self.leaves_map.get(self.get_leaf_hash(id))
+            require(slot is not None, f"Unknown leaf with id {id}")
+
+            balances = parse_balance(balance_dict)
+            require(all(amount >= 0 for amount in balances.values()), "All balances must be positive")
+            updates.append((slot, balances))
+
+        for slot, balances in updates:
+            self.tree.clear_balances(slot)
+            self.tree.set_balances(slot, balances)
+
+        return self._recompute_paths({ slot for slot, _ in updates }, set())
+
+    '''
+        Inserts new leaves into empty leaves of the last level and recomputes the nodes in the paths from
+        those leaves to the root. The new leaves take the next positions (see positions_count), as if they
+        were appended to the supplied leaves. Returns the nodes that changed.
+
+        The empty leaves must stay at the end of the last level, so in a shuffled tree each new leaf takes a
+        random slot among the leaves and the first empty leaf, and the leaf in that slot is moved to the first
+        empty leaf. This keeps the order of the leaves as random as if they were shuffled together.
+    '''
+    def insert_leaves(self, leaves: Iterable[Leaf]) -> TreeUpdate:
+        inserts = []
+        hashes = set()
+        for leaf in leaves:
+            hash = self.get_leaf_hash(leaf.id)
+            require(hash not in self.leaves_map and hash not in hashes, f"Duplicate leaf with id {leaf.id}")
+
+            balances = parse_balance(leaf.balances)
+            require(all(amount >= 0 for amount in balances.values()), "All balances must be positive")
+
+            hashes.add(hash)
+            inserts.append((hash, balances))
+
+        total_leaves = self.tree.total_leaves
+        leaves_count = len(self.leaf_positions)
+        require(leaves_count + len(inserts) <= total_leaves, "There are not enough empty leaves to insert the leaves")
+
+        self.tree.resize(leaves_count + len(inserts))
+        changed = set()
+
+        for hash, balances in inserts:
+            slot = len(self.leaf_positions)
+            self.leaf_positions.append(self.positions_count)
+
+            target = random.randint(0, slot) if self.shuffle else slot
+            if target != slot:
+                self._move_leaf(target, slot)
+
+            self._set_leaf(target, hash, balances, self.positions_count)
+            self.positions_count += 1
+            changed |= { total_leaves + slot, total_leaves + target }
+
+        return self._recompute_paths(changed, changed)
+
+    '''
+        Removes leaves given their ids and recomputes the nodes in the paths from those leaves to the root. The
+        positions of the rest of the leaves do not change. Returns the nodes that changed.
+
+        The empty leaves must stay at the end of the last level, so the last leaf is moved to the slot of each
+        removed leaf.
+    '''
+    def remove_leaves(self, ids: Iterable[str]) -> TreeUpdate:
+        removals = dict()
+        for id in ids:
+            hash = self.get_leaf_hash(id)
+            require(hash in self.leaves_map, f"Unknown leaf with id {id}")
+            removals[hash] = id
+
+        total_leaves = self.tree.total_leaves
+        changed, moved = set(), set()
+
+        for hash in removals:
+            slot = self.leaves_map.pop(hash) - total_leaves
+            last_slot = len(self.leaf_positions) - 1
+
+            if slot != last_slot:
+                self._move_leaf(last_slot, slot)
+                moved.add(total_leaves + slot)
+
+            self.leaf_positions.pop()
+            self.tree.resize(last_slot)
+            changed |= { total_leaves + slot, total_leaves + last_slot }
+
+        leaves_end = total_leaves + len(self.leaf_positions)
+        return self._recompute_paths(changed, { slot for slot in moved if slot < leaves_end })
+
+    def _set_leaf(self, slot: int, hash: bytes, balances: dict[str, int], position: int) -> None:
+        leaf_store = self.tree.levels[0]
+        leaf_store.set_hash(slot, hash)
+        leaf_store.clear_balances(slot)
+        leaf_store.set_balances(slot, balances)
+
+        self.leaves_map[hash] = self.tree.total_leaves + slot
+        self.leaf_positions[slot] = position
+
+    def _move_leaf(self, slot: int, target: int) -> None:
+        leaf_store = self.tree.levels[0]
+        self._set_leaf(target, leaf_store.get_hash(slot), leaf_store.get_balances(slot), self.leaf_positions[slot])
+
+    '''
+        Recomputes the union of the paths from the given leaf slots to the root, one level at a time so that
+        every dirty node is combined once, after both of its children. The nodes that became empty are not stored.
+    '''
+    def _recompute_paths(self, leaf_slots: set[int], new_leaves: set[int]) -> TreeUpdate:
+        dirty_nodes = set(leaf_slots)
+        for slot in leaf_slots:
+            self.encodings.discard(slot)
+
+        level = leaf_slots
+        while len(level) > 0 and min(level) > 1:
+            level = { index // 2 for index in level }
+
+            for index in sorted(level):
+                self.encodings.discard(index)
+                if self.tree.is_stored(index):
+                    self.tree.clear_balances(index)
+                    _combine_stored_nodes(self.hash_function, self.tree, index, self.encodings)
+
+            dirty_nodes |= level
+
+        return TreeUpdate(dirty_nodes, new_leaves)
+
+    '''
+        Writes the tree into a binary snapshot file (see lib/snapshot.py) which can be loaded with load.
+    '''
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as file:
+            write_snapshot(file, self.hash_type, self.salt, self.tree, self.leaf_positions, self.positions_count, self.leaves_map)
+
+    '''
+        Loads a tree from a snapshot written by save. The file is memory mapped and nodes are only read
+        when they are requested, so the tree is neither built nor fully read. The loaded tree is read only.
+    '''
+    @staticmethod
+    def load(path: str) -> 'MerkleSumTree':
+        snapshot = read_snapshot(path)
+
+        tree = MerkleSumTree.__new__(MerkleSumTree)
+        tree.hash_function = getattr(hashlib, snapshot.hash_type)
+        tree.hash_type = snapshot.hash_type
+        tree.salt = snapshot.salt
+        tree.shuffle = True
+        tree.tree = TreeStore.from_levels(snapshot.levels, get_empty_hashes(tree.hash_function, len(snapshot.levels) - 1))
+        tree.leaves_map = LeafIndex(tree.tree, snapshot.sorted_slots)
+        tree.leaf_positions = snapshot.leaf_positions
+        tree.positions_count = snapshot.positions_count
+        tree.encodings = EncodingCache()
+
+        return tree
 
     '''
         Combines a left and right node to construct the parent node
@@ -114,20 +468,28 @@ class MerkleSumTree():
         and the sum of the balances.
     '''
     def _combine_tree_nodes(self, left: Node, right: Node) -> Node:
-        return Node(
-            self.hash_function(
-                left.hash + str.encode(to_string(left.balances))
-                +
-                right.hash + str.encode(to_string(right.balances))
-            ).digest(),
-            combine_balances(left.balances, right.balances),
-        )
+        return combine_nodes(self.hash_function, left, right)
+
+    def _get_node(self, index: int) -> Node:
+        return _load_node(self.tree, index, self.encodings)
 
     def get_root(self) -> Node:
-        return self.tree[1]
+        return self._get_node(1)
 
-    def get_nodes(self) -> list[Node]:
-        return self.tree[1:]
+    def get_nodes(self) -> 'NodeView':
+        return NodeView(self)
+
+    '''
+        Gets the merkle leaf hash for the given id, that is the hash of the salt followed by the id.
+    '''
+    def get_leaf_hash(self, id: str) -> bytes:
+        return self.hash_function(str.encode(self.salt + id)).digest()
+
+    '''
+        Gets the leaf node for the given id.
+    '''
+    def get_leaf(self, id: str) -> Node:
+        return self._get_node(self.leaves_map[self.get_leaf_hash(id)])
 
     '''
         For a given leaf, gets the proof as a list of ProofSteps objects with the
@@ -135,27 +497,344 @@ class MerkleSumTree():
         of the leaf, the hash is computed and then the discovery starts.
     '''
     def get_proof(self, id: str) -> list[ProofStep]:
-        proof_length = int(math.log(len(self.tree) - 1, 2))
+        proof_length = self.tree.height
         proof = []
 
-        hash = self.hash_function(str.encode(self.salt + id)).digest()
-        current_index = self.leaves_map[hash]
+        current_index = self.leaves_map[self.get_leaf_hash(id)]
 
         for _ in range(proof_length):
-            is_right = current_index % 2 != 0
-            
-            if is_right:
-                sibling = self.tree[current_index - 1]
-            else:
-                sibling = self.tree[current_index + 1]
-
-            proof.append(
-                ProofStep(Side.RIGHT if not is_right else Side.LEFT, sibling.hash, sibling.balances)
-            )
+            proof.append(self.get_proof_step(current_index ^ 1))
             current_index = current_index // 2
             
         return proof
 
+    '''
+        Gets the proof step whose sibling is the node at the given index, which is on the left
+        when the index is even.
+    '''
+    def get_proof_step(self, index: int) -> ProofStep:
+        sibling = self._get_node(index)
+        return ProofStep(Side.LEFT if index % 2 == 0 else Side.RIGHT, sibling.hash, sibling.balances, sibling.encode_balances())
+
+    '''
+        Iterates over the proofs of every leaf in the order of the last level of the tree, yielding
+        the position of the leaf in the supplied leaves and its proof. The leaf hashes are not computed
+        again and, since a sibling at level d is shared by 2^d consecutive leaves, the last step of each
+        level is reused by the following proofs, so each ProofStep is created and stringified once.
+
+        If an update is given only the proofs that it made stale are yielded (see TreeUpdate.is_proof_stale).
+    '''
+    def iter_proofs(self, update: Optional[TreeUpdate] = None) -> Iterator[tuple[int, list[ProofStep]]]:
+        total_leaves = self.tree.total_leaves
+        proof_length = self.tree.height
+
+        steps: list[Optional[ProofStep]] = [None] * proof_length
+        step_indexes = [0] * proof_length
+
+        for slot, position in enumerate(self.leaf_positions):
+            current_index = total_leaves + slot
+
+            if update is not None and not update.is_proof_stale(current_index):
+                continue
+
+            proof = []
+
+            for level in range(proof_length):
+                sibling_index = current_index ^ 1
+
+                if step_indexes[level] != sibling_index:
+                    sibling = self._get_node(sibling_index)
+                    steps[level] = ProofStep(
+                        Side.LEFT if current_index % 2 != 0 else Side.RIGHT, sibling.hash, sibling.balances, sibling.encode_balances()
+                    )
+                    step_indexes[level] = sibling_index
+
+                proof.append(steps[level])
+                current_index = current_index // 2
+
+            yield position, proof
+
+    '''
+        Checks in a single pass over the stored nodes that the tree is consistent: no leaf has a negative
+        balance and the hash and balances of every node are the combination of its children. Every node is
+        read and stringified once, so the check is linear in the size of the tree, unlike verifying the
+        proof of every leaf. Raises an exception on the first node that does not match its children.
+    '''
+    def verify_nodes(self) -> None:
+        leaves = self.tree.levels[0]
+        for column in leaves.columns.values():
+            require(min(column[:len(leaves)], default = ABSENT) >= ABSENT, "At least one balance was negative")
+
+        for level in range(1, self.tree.height + 1):
+            children, store = self.tree.levels[level - 1], self.tree.levels[level]
+
+            for position in range(len(store)):
+                left_balances = children.get_balances(2 * position)
+                left_hash, left_encoded = children.get_hash(2 * position), format_balance(left_balances)
+
+                if 2 * position + 1 < len(children):
+                    right_balances = children.get_balances(2 * position + 1)
+                    right_hash, right_encoded = children.get_hash(2 * position + 1), format_balance(right_balances)
+                else:
+                    right_balances, right_hash, right_encoded = dict(), self.tree.empty_hashes[level - 1], ''
+
+                index = self.tree.get_index(level, position)
+                require(
+                    store.get_hash(position) == hash_children(self.hash_function, left_hash, left_encoded, right_hash, right_encoded),
+                    f"Hash of node {index} is not equal to the hash of its children"
+                )
+                require(
+                    store.get_balances(position) == combine_units(left_balances, right_balances),
+                    f"Balances of node {index} are not equal to the sum of its children"
+                )
+
+class NodeView(Sequence):
+    '''
+        Read only view of the nodes of a tree that are not empty, from top to bottom and from left to right.
+        Since the empty nodes are the last ones of each level, the nodes of each level are the first ones
+        and the rest of the level is empty. The Node objects are created when they are accessed so the
+        whole tree is never materialized.
+    '''
+    def __init__(self, tree: MerkleSumTree) -> None:
+        self._tree = tree
+        self._level_starts = list(accumulate([len(level) for level in reversed(tree.tree.levels)], initial = 0))
+
+    def __len__(self) -> int:
+        return self._level_starts[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Node index out of range")
+
+        depth = bisect_right(self._level_starts, index) - 1
+        return self._tree._get_node((1 << depth) + index - self._level_starts[depth])
+
+'''
+    Gets the stringified balances of a stored node from the cache, or stringifies them and
+    adds them to the cache if they are not there.
+'''
+def _encode_stored_balances(store: TreeStore, index: int, encodings: Optional[EncodingCache]) -> str:
+    encoded = None if encodings is None else encodings.get(index)
+
+    if encoded is None:
+        encoded = format_balance(store.get_balances(index))
+        if encodings is not None:
+            encodings.put(index, encoded)
+
+    return encoded
+
+def _load_node(store: TreeStore, index: int, encodings: Optional[EncodingCache] = None) -> Node:
+    return Node(
+        store.get_hash(index),
+        from_units_balance(store.get_balances(index)),
+        _encode_stored_balances(store, index, encodings)
+    )
+
+'''
+    Hashes the concatenation of the hashes and stringified balances of a left and right node.
+'''
+def hash_children(hash_function, left_hash: bytes, left_encoded: str, right_hash: bytes, right_encoded: str) -> bytes:
+    return hash_function(left_hash + str.encode(left_encoded) + right_hash + str.encode(right_encoded)).digest()
+
+def _combine_stored_nodes(hash_function, store: TreeStore, index: int, encodings: Optional[EncodingCache]) -> None:
+    store.set_hash(index, hash_children(
+        hash_function,
+        store.get_hash(2 * index), _encode_stored_balances(store, 2 * index, encodings),
+        store.get_hash(2 * index + 1), _encode_stored_balances(store, 2 * index + 1, encodings)
+    ))
+    store.set_balances(index, combine_units(store.get_balances(2 * index), store.get_balances(2 * index + 1)))
+
+'''
+    Gets the hash of the empty node of each height up to the given one. The empty leaf has an EMPTY_NODE_HASH
+    and no balances, and the empty node of each height combines two empty nodes of the height below.
+'''
+def get_empty_hashes(hash_function, height: int) -> list[bytes]:
+    empty_hashes = [EMPTY_NODE_HASH]
+    for _ in range(height):
+        empty_hashes.append(hash_children(hash_function, empty_hashes[-1], '', empty_hashes[-1], ''))
+
+    return empty_hashes
+
+def _store_node(tree: TreeStore, level: int, position: int, hash: bytes, balances: dict[str, int], encoded: str, encodings: Optional[EncodingCache]) -> None:
+    tree.levels[level].set_hash(position, hash)
+    tree.levels[level].set_balances(position, balances)
+
+    if encodings is not None:
+        index = tree.get_index(level, position)
+        if encodings.is_pinned(index):
+            encodings.put(index, encoded)
+
+'''
+    Computes the nodes of a tree above the given level, whose nodes are already stored.
+
+    The nodes are built in post order keeping a stack with the pending left nodes (one per level at
+    most), so the balances of the children never have to be read back from the store. The balances of
+    every node are stringified once, and kept in the encodings cache if the node is pinned in it.
+    The last node of a level may have an empty right sibling, which is never stored: its hash is taken
+    from the empty hashes of the tree and, since it has no balances, the parent has the same balances.
+'''
+def _build_internal_nodes(tree: TreeStore, hash_function, encodings: Optional[EncodingCache] = None, base_level: int = 0) -> None:
+    stack = []
+    base_store = tree.levels[base_level]
+
+    for position in range(len(base_store)):
+        level = base_level
+        hash, balances = base_store.get_hash(position), base_store.get_balances(position)
+        encoded = format_balance(balances)
+
+        while position % 2 == 1:
+            _, _, left_hash, left_balances, left_encoded = stack.pop()
+            hash = hash_children(hash_function, left_hash, left_encoded, hash, encoded)
+            balances = combine_units(left_balances, balances)
+            encoded = format_balance(balances)
+            level, position = level + 1, position // 2
+
+            _store_node(tree, level, position, hash, balances, encoded, encodings)
+
+        stack.append((level, position, hash, balances, encoded))
+
+    if len(stack) == 0:
+        return
+
+    # The last node of the stack has an empty right sibling, and so do its ancestors unless they are right children
+    level, position, hash, balances, encoded = stack.pop()
+    while level < tree.height:
+        if position % 2 == 1:
+            _, _, left_hash, left_balances, left_encoded = stack.pop()
+            hash = hash_children(hash_function, left_hash, left_encoded, hash, encoded)
+            balances = combine_units(left_balances, balances)
+            encoded = format_balance(balances)
+        else:
+            hash = hash_children(hash_function, hash, encoded, tree.empty_hashes[level], '')
+        level, position = level + 1, position // 2
+
+        _store_node(tree, level, position, hash, balances, encoded, encodings)
+
+'''
+    Hashes the ids of a batch of leaves with the salt and turns its balances into the values of the columns of a
+    NodeStore, validating that they are positive. Returns the concatenated hashes, the bytes hashed and the columns.
+    The hash function can be a hash type, as the workers of a process pool get it.
+'''
+def _encode_leaf_batch(
+    hash_function, salt: str, ids: list[str], balances: dict[str, list[Optional[int]]]
+) -> tuple[bytes, int, dict[str, Union[array, list[int]]]]:
+    if isinstance(hash_function, str):
+        hash_function = getattr(hashlib, hash_function)
+
+    encoded = [str.encode(salt + id) for id in ids]
+    hashes = b''.join([hash_function(data).digest() for data in encoded])
+
+    columns = dict()
+    for currency, amounts in balances.items():
+        values = columns[currency] = to_column_values(amounts)
+        # Every amount below ABSENT is negative, and so is an amount equal to ABSENT that was not None
+        require(min(values, default = 0) >= ABSENT and values.count(ABSENT) == amounts.count(None), "All balances must be positive")
+
+    return hashes, sum(map(len, encoded)), columns
+
+'''
+    Yields every leaf together with its batch encoded by _encode_leaf_batch if it was encoded in the executor,
+    or None otherwise. The batches are submitted as they are read, and at most two per worker are pending at
+    once, so the leaves are yielded in the same order without reading all of them first.
+'''
+def _iter_encoded_leaves(
+    leaves: Iterable[Union[Leaf, LeafBatch]], hash_type: str, salt: str, executor: Optional[ProcessPoolExecutor], workers: int
+) -> Iterator[tuple[Union[Leaf, LeafBatch], Optional[tuple]]]:
+    pending = deque()
+
+    for leaf in leaves:
+        if executor is None:
+            yield leaf, None
+            continue
+
+        pending.append((
+            leaf, executor.submit(_encode_leaf_batch, hash_type, salt, leaf.ids, leaf.balances) if isinstance(leaf, LeafBatch) else None
+        ))
+        while pending and (len(pending) > 2 * workers or pending[0][1] is None):
+            leaf, future = pending.popleft()
+            yield leaf, None if future is None else future.result()
+
+    while pending:
+        leaf, future = pending.popleft()
+        yield leaf, None if future is None else future.result()
+
+'''
+    Builds the levels of a subtree of the given height given the store of its leaves, which may hold
+    less leaves than the subtree. Returns the levels above the leaves, the number of hashes computed
+    and the bytes hashed.
+'''
+def _build_subtree(leaves: NodeStore, height: int, hash_type: str) -> tuple[list[NodeStore], int, int]:
+    hash_function = HashCounter(getattr(hashlib, hash_type))
+    tree = TreeStore(height, len(leaves), get_empty_hashes(hash_function, height), leaves.hash_size)
+    tree.levels[0].copy_from(leaves, 0, 0, len(leaves))
+
+    _build_internal_nodes(tree, hash_function)
+
+    return tree.levels[1:], hash_function.calls, hash_function.bytes
+
+'''
+    Computes the internal nodes of the tree splitting the last level into a power of two number of subtrees,
+    and building the subtrees that hold leaves in the workers of the executor. The nodes of level h of subtree j are a run
+    of the nodes of level h of the tree, starting at j * subtree_size / 2^h. The nodes above the roots of the
+    subtrees are then built in this process. The hashes computed by the workers are added to hash_function
+    if it is a HashCounter.
+'''
+def _build_tree_parallel(
+    tree: TreeStore, hash_type: str, executor: ProcessPoolExecutor, workers: int, encodings: EncodingCache, hash_function
+) -> None:
+    subtrees_count = min(get_prev_pow_2(workers), tree.total_leaves)
+    subtree_size = tree.total_leaves // subtrees_count
+    subtree_height = subtree_size.bit_length() - 1
+    leaves = tree.levels[0]
+
+    chunks = []
+    for start in range(0, len(leaves), subtree_size):
+        chunk = NodeStore(min(subtree_size, len(leaves) - start), leaves.hash_size)
+        chunk.copy_from(leaves, start, 0, len(chunk))
+        chunks.append(chunk)
+
+    subtrees = executor.map(_build_subtree, chunks, [subtree_height] * len(chunks), [hash_type] * len(chunks))
+
+    # The leaves are already in the tree, so the workers only send back the levels above them
+    for j, (levels, calls, hashed_bytes) in enumerate(subtrees):
+        if isinstance(hash_function, HashCounter):
+            hash_function.calls += calls
+            hash_function.bytes += hashed_bytes
+
+        for level in range(1, subtree_height + 1):
+            tree.levels[level].copy_from(levels[level - 1], 0, (j * subtree_size) >> level, len(levels[level - 1]))
+
+    _build_internal_nodes(tree, hash_function, encodings, subtree_height)
+
+'''
+    Stringifies a proof as a list of its steps, with the format '[{side,hash,balances},...]'.
+'''
+def proof_to_string(proof: list[ProofStep]) -> str:
+    return f"[{','.join([f'{{{step.to_string()}}}' for step in proof])}]"
+
+'''
+    Encodes a proof in the binary proof format (see lib/binary_proof.py) with the given currency dictionary.
+'''
+def encode_proof(proof: list[ProofStep], dictionary: CurrencyDictionary) -> bytes:
+    hash_size = len(proof[0].hash) if len(proof) != 0 else len(EMPTY_NODE_HASH)
+    header = encode_proof_header([step.side == Side.LEFT for step in proof], hash_size)
+
+    return header + b''.join([step.to_bytes(dictionary) for step in proof])
+
+'''
+    Decodes a proof encoded with encode_proof given the same currency dictionary.
+'''
+def decode_proof(data: bytes, dictionary: CurrencyDictionary) -> list[ProofStep]:
+    return [
+        ProofStep(Side.LEFT if is_left else Side.RIGHT, hash, from_units_balance(balances), format_balance(balances))
+        for is_left, hash, balances, _ in iter_binary_proof(data, dictionary)
+    ]
+
 '''
     Combines two dictionary of balances by summing the amounts of them where the key
     defines the currency name. If any key exists in one of the dictionaries and not on the other
@@ -179,6 +858,19 @@ def to_string(balances: dict[str, Decimal]) -> str:
 def to_decimal_balance(balance_dict: dict[str, str]) -> dict[str, Decimal]:
     return { k: round(Decimal(v), DECIMAL_PRECISION) for k, v in balance_dict.items() }
 
+'''
+    Converts integer amounts scaled by 10^DECIMAL_PRECISION to rounded decimal balances. The decimals
+    keep the exponent of rounded decimals so the stringified balances do not change.
+'''
+def from_units_balance(balances: dict[str, int]) -> dict[str, Decimal]:
+    return { k: Decimal(v).scaleb(-DECIMAL_PRECISION) for k, v in balances.items() }
+
+'''
+    Converts rounded decimal balances to integer amounts scaled by 10^DECIMAL_PRECISION.
+'''
+def to_units_balance(balances: dict[str, Decimal]) -> dict[str, int]:
+    return { k: int(v.scaleb(DECIMAL_PRECISION)) for k, v in balances.items() }
+
 def verify_merkle_proof(root_node: Node, steps: list[ProofStep], salt: str, leaf: Leaf, hash_type: str = 'sha256'):
     hash_fun = getattr(hashlib, hash_type)
     node = Node(hash_fun(str.encode(salt + leaf.id)).digest(), to_decimal_balance(leaf.balances))
@@ -189,8 +881,11 @@ def verify_merkle_proof(root_node: Node, steps: list[ProofStep], salt: str, leaf
     asserts at each step that the balance is greater or equal than zero for all balances and applies the 
     node combination process to construct the path to the root node. Finally it asserts that the root hash
     is the same as the obtained hash and that the root balances are the same as the obtained balances.
+    If on_step is given it is called after each step with the number of the step and the node obtained.
 '''
-def verify_merkle_proof_from_leaf(root_node: Node, steps: list[ProofStep], leaf_node: Node, hash_type: str = 'sha256') -> tuple[str, str]:
+def verify_merkle_proof_from_leaf(
+    root_node: Node, steps: list[ProofStep], leaf_node: Node, hash_type: str = 'sha256', on_step: Optional[Callable[[int, Node], None]] = None
+) -> tuple[str, str]:
     hash_fun = getattr(hashlib, hash_type)
     current = leaf_node
 
@@ -201,21 +896,22 @@ def verify_merkle_proof_from_leaf(root_node: Node, steps: list[ProofStep], leaf_
         require(all(amount >= 0 for amount in current.balances.values()), "At least one balance was negative")
         
         if step.side == Side.RIGHT:
-            left = current.hash + str.encode(to_string(current.balances))
-            right = step.hash + str.encode(to_string(step.balances))
+            left = current.hash + str.encode(current.encode_balances())
+            right = step.hash + str.encode(step.encode_balances())
             sum_balances = combine_balances(current.balances, step.balances)
         else:
-            left = step.hash + str.encode(to_string(step.balances))
-            right = current.hash + str.encode(to_string(current.balances))
+            left = step.hash + str.encode(step.encode_balances())
+            right = current.hash + str.encode(current.encode_balances())
             sum_balances = combine_balances(step.balances, current.balances)
 
         current = Node(hash_fun(left + right).digest(), sum_balances)
-        print(f"Step {idx + 1}, hash: {current.hash.hex()}")
+        if on_step is not None:
+            on_step(idx + 1, current)
 
     require(current.hash == root_node.hash, "Root hash is not equal to obtained hash")
     require(current.balances == root_node.balances, "Root balances are not equal to obtained balances")
 
-    return current.hash.hex(), to_string(current.balances)
+    return current.hash.hex(), current.encode_balances()
     
 def get_next_pow_2(n):
     p = 1
@@ -224,5 +920,9 @@ def get_next_pow_2(n):
 
     return p
 
-def require(statement: bool, message: str):
-     if not statement: raise Exception(message)
+def get_prev_pow_2(n):
+    p = 1
+    while (p * 2 <= n):
+        p *= 2
+
+    return p
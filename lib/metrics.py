@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+T = TypeVar('T')
+
+_END = object()
+
+'''
+    Gets the peak resident set size of the current process in bytes, or None where it is not available.
+'''
+def get_peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+'''
+    Gets the CPU time used by this process and by its child processes that have finished.
+'''
+def get_cpu_time() -> float:
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+class Metrics():
+    '''
+        Collects the metrics of a run: the wall and CPU time spent in each phase, counters and other values.
+        A phase can be entered many times, its times and calls are added up. The CPU time includes the child
+        processes, such as the workers of a parallel build, once they have finished.
+
+        If on_progress is given it is called with the phase, the amount done and the total amount (or None if
+        unknown) as the phases advance, at most once every progress_interval seconds.
+    '''
+    def __init__(self, on_progress: Optional[Callable[[str, int, Optional[int]], None]] = None, progress_interval: float = 10.0) -> None:
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.phases: dict[str, dict[str, float]] = dict()
+        self.counters: dict[str, int] = dict()
+        self.values: dict[str, object] = dict()
+        self._done: dict[str, int] = dict()
+        self._last_progress = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str):
+        wall, cpu = time.perf_counter(), get_cpu_time()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(name, dict({'wall': 0.0, 'cpu': 0.0, 'calls': 0}))
+            phase['wall'] += time.perf_counter() - wall
+            phase['cpu'] += get_cpu_time() - cpu
+            phase['calls'] += 1
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    '''
+        Adds amount to the progress of a phase, calling on_progress if progress_interval seconds went by
+        since the last call.
+    '''
+    def advance(self, phase: str, amount: int, total: Optional[int] = None) -> None:
+        done = self._done[phase] = self._done.get(phase, 0) + amount
+
+        if self.on_progress is not None and time.monotonic() - self._last_progress >= self.progress_interval:
+            self._last_progress = time.monotonic()
+            self.on_progress(phase, done, total)
+
+    def to_dict(self) -> dict:
+        return dict({
+            'phases': self.phases,
+            'counters': self.counters,
+            'values': self.values,
+            'peak_rss_bytes': get_peak_rss()
+        })
+
+    def write(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, indent = 4)
+
+class HashCounter():
+    '''
+        Wraps a hashlib constructor counting the calls and the bytes hashed.
+    '''
+    def __init__(self, hash_function) -> None:
+        self.hash_function = hash_function
+        self.calls = 0
+        self.bytes = 0
+
+    def __call__(self, data: bytes = b''):
+        self.calls += 1
+        self.bytes += len(data)
+        return self.hash_function(data)
+
+'''
+    Times a phase in the metrics, or does nothing if metrics is None.
+'''
+def phase(metrics: Optional[Metrics], name: str):
+    return nullcontext() if metrics is None else metrics.phase(name)
+
+'''
+    Yields the items of an iterable timing in a phase the time spent getting each of them, and advancing the
+    progress of the phase by the size of each item (one by default). Yields the items as they are if metrics is None.
+'''
+def iterate(
+    metrics: Optional[Metrics], name: str, items: Iterable[T], total: Optional[int] = None, size: Optional[Callable[[T], int]] = None
+) -> Iterator[T]:
+    if metrics is None:
+        yield from items
+        return
+
+    iterator = iter(items)
+    while True:
+        with metrics.phase(name):
+            item = next(iterator, _END)
+
+        if item is _END:
+            return
+
+        metrics.advance(name, 1 if size is None else size(item), total)
+        yield item
@@ -0,0 +1,185 @@
+import csv
+import hashlib
+import io
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterator, Optional, Union
+from lib.errors import require
+from lib.binary_proof import PROOFS_FILE_MAGIC, encode_proof_record, decode_proof_record
+
+INDEX_FILE_NAME: str = 'index.bin'
+INDEX_MAGIC: bytes = b'POLI'
+INDEX_VERSION: int = 2
+
+PROOF_FORMATS = ['text', 'binary']
+
+# Magic, version, format of the proofs (its position in PROOF_FORMATS), number of shards and number of slots of the index
+INDEX_HEADER = struct.Struct('<4sHHHQ')
+# Prefix of the leaf hash, shard, offset of the row in the shard and length of the row
+INDEX_RECORD = struct.Struct('<16sHQI')
+KEY_SIZE: int = 16
+
+def shard_file_name(shard: int, proof_format: str = 'text') -> str:
+    return f"proofs-{shard:05d}.{'bin' if proof_format == 'binary' else 'csv'}"
+
+def get_shard(leaf_hash: bytes, shards_count: int) -> int:
+    return int.from_bytes(leaf_hash[:8], 'little') % shards_count
+
+'''
+    Yields the offsets of the index slots that must be checked, in order, to find a leaf hash.
+    The index is an open addressing hash table with linear probing.
+'''
+def _probe(leaf_hash: bytes, slots_count: int) -> Iterator[int]:
+    slot = int.from_bytes(leaf_hash[8:KEY_SIZE], 'little') % slots_count
+
+    for _ in range(slots_count):
+        yield INDEX_HEADER.size + slot * INDEX_RECORD.size
+        slot = (slot + 1) % slots_count
+
+class ShardedProofWriter():
+    '''
+        Writes the proofs into shards_count files inside directory, each row having the same format as the proofs
+        output of main.py, choosing the file by the leaf hash. Text proofs are written as CSV rows, and binary proofs
+        as the records of a file of binary proofs (see lib/binary_proof.py). It also writes a binary index in the
+        same directory which maps each leaf hash to the shard, offset and length of its row.
+
+        The index is a hash table with room for a third more proofs than proofs_count, so that a leaf hash
+        is found in one or two reads. Empty slots have a length of zero.
+    '''
+    def __init__(self, directory: str, shards_count: int, proofs_count: int, proof_format: str = 'text') -> None:
+        require(0 < shards_count <= 0xFFFF, "The number of shards must be between 1 and 65535")
+        require(proof_format in PROOF_FORMATS, f"Unknown proof format {proof_format}")
+
+        self.proof_format = proof_format
+        os.makedirs(directory, exist_ok = True)
+        self._shards = [open(os.path.join(directory, shard_file_name(shard, proof_format)), 'wb') for shard in range(shards_count)]
+        self._offsets = [0] * shards_count
+
+        if proof_format == 'binary':
+            for shard in self._shards:
+                shard.write(PROOFS_FILE_MAGIC)
+            self._offsets = [len(PROOFS_FILE_MAGIC)] * shards_count
+
+        self._slots_count = proofs_count * 4 // 3 + 1
+        self._proofs_count = 0
+        self._index_file = open(os.path.join(directory, INDEX_FILE_NAME), 'w+b')
+        self._index_file.truncate(INDEX_HEADER.size + self._slots_count * INDEX_RECORD.size)
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        INDEX_HEADER.pack_into(
+            self._index, 0, INDEX_MAGIC, INDEX_VERSION, PROOF_FORMATS.index(proof_format), shards_count, self._slots_count
+        )
+
+        self._row = io.StringIO()
+        self._row_writer = csv.writer(self._row)
+
+    '''
+        Writes the proof of a user, a stringified proof or the bytes of a binary proof depending on the format.
+    '''
+    def write(self, leaf_hash: bytes, id: str, proof: Union[str, bytes]) -> None:
+        require(self._proofs_count < self._slots_count, "The proof index is full")
+
+        if self.proof_format == 'binary':
+            row = encode_proof_record(id, proof)
+        else:
+            self._row.seek(0)
+            self._row.truncate()
+            self._row_writer.writerow([id, proof])
+            row = self._row.getvalue().encode('utf-8')
+
+        shard = get_shard(leaf_hash, len(self._shards))
+        self._shards[shard].write(row)
+
+        for record_offset in _probe(leaf_hash, self._slots_count):
+            key, _, _, length = INDEX_RECORD.unpack_from(self._index, record_offset)
+            if length == 0:
+                break
+            require(key != leaf_hash[:KEY_SIZE], f"Duplicate proof for id {id}")
+
+        INDEX_RECORD.pack_into(self._index, record_offset, leaf_hash[:KEY_SIZE], shard, self._offsets[shard], len(row))
+        self._offsets[shard] += len(row)
+        self._proofs_count += 1
+
+    def close(self) -> None:
+        for shard in self._shards:
+            shard.close()
+
+        self._index.flush()
+        self._index.close()
+        self._index_file.close()
+
+    def __enter__(self) -> 'ShardedProofWriter':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+class ProofIndex():
+    '''
+        Reads single proofs from a directory written by ShardedProofWriter. The index is memory mapped, so
+        finding a proof takes a lookup in the index and a single seek and read in its shard.
+    '''
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+        self._index_file = open(os.path.join(directory, INDEX_FILE_NAME), 'rb')
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, proof_format, self._shards_count, self._slots_count = INDEX_HEADER.unpack_from(self._index, 0)
+        require(magic == INDEX_MAGIC and version == INDEX_VERSION, "Unsupported proof index file")
+        self.proof_format = PROOF_FORMATS[proof_format]
+
+        self._shards: dict[int, BinaryIO] = dict()
+
+    '''
+        Gets the id and the proof stored for a leaf hash, or None if there is no proof for it. The proof
+        is a stringified proof or the bytes of a binary proof depending on the format of the index.
+    '''
+    def get(self, leaf_hash: bytes) -> Optional[tuple[str, Union[str, bytes]]]:
+        for record_offset in _probe(leaf_hash, self._slots_count):
+            key, shard, offset, length = INDEX_RECORD.unpack_from(self._index, record_offset)
+
+            if length == 0:
+                return None
+
+            if key == leaf_hash[:KEY_SIZE]:
+                row = self._read_row(shard, offset, length)
+                if self.proof_format == 'binary':
+                    id, proof, _ = decode_proof_record(row, 0)
+                    return id, proof
+
+                id, proof = next(csv.reader([row.decode('utf-8').rstrip('\r\n')]))
+                return id, proof
+
+        return None
+
+    '''
+        Gets the proof of a user given its id and the audit id, or None if there is no proof for it.
+    '''
+    def find(self, id: str, audit_id: str, hash_type: str = 'sha256') -> Optional[Union[str, bytes]]:
+        result = self.get(getattr(hashlib, hash_type)(str.encode(audit_id + id)).digest())
+
+        if result is None or result[0] != id:
+            return None
+
+        return result[1]
+
+    def _read_row(self, shard: int, offset: int, length: int) -> bytes:
+        file = self._shards.get(shard)
+        if file is None:
+            file = self._shards[shard] = open(os.path.join(self._directory, shard_file_name(shard, self.proof_format)), 'rb')
+
+        file.seek(offset)
+        return file.read(length)
+
+    def close(self) -> None:
+        for file in self._shards.values():
+            file.close()
+
+        self._index.close()
+        self._index_file.close()
+
+    def __enter__(self) -> 'ProofIndex':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -0,0 +1,188 @@
+import asyncio
+import base64
+import json
+import sys
+from typing import Optional
+from urllib.parse import unquote, urlsplit, parse_qs
+from lib.merkle import MerkleSumTree, ProofStep, EMPTY_NODE_HASH
+from lib.binary_proof import CurrencyDictionary, encode_proof_header
+from lib.storage import LRUCache
+from lib.proof_index import PROOF_FORMATS
+
+# Longest request head (request line and headers) that is accepted
+MAX_HEAD_SIZE: int = 8192
+
+_REASONS = dict({ 200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed' })
+
+class ProofRenderer():
+    '''
+        Renders the responses of the proofs of a tree on demand. The nodes of the top pinned_levels levels are part of
+        most proofs, so the text and bytes of their proof steps are rendered when the renderer is created and kept.
+        The rendered responses of the last requested proofs are kept in a least recently used cache, so repeated
+        requests during a spike do not load nodes again.
+
+        Both share a budget of cache_bytes bytes per renderer: the steps of each pinned level take their size in memory
+        from it, from the top, as long as the whole level fits, and the cache of the responses takes the rest.
+    '''
+    def __init__(self, tree: MerkleSumTree, pinned_levels: int = 16, cache_bytes: int = 2 ** 26) -> None:
+        self.tree = tree
+        root = tree.get_root()
+        self.dictionary = CurrencyDictionary(root.balances)
+        self.hash_size = len(root.hash)
+        self.root_body = _to_json(dict({
+            'root_hash': root.hash.hex(),
+            'root_balances': root.encode_balances(),
+            'hash_algorithm': tree.hash_type
+        }))
+
+        self._pinned: dict[int, tuple[str, bytes]] = dict()
+        self.pinned_bytes = 0
+        for level in range(1, min(pinned_levels, tree.tree.height) + 1):
+            rendered = { index: self._render_step(index) for index in range(1 << level, 1 << (level + 1)) }
+            level_bytes = sum(sys.getsizeof(text) + sys.getsizeof(data) for text, data in rendered.values())
+            if self.pinned_bytes + level_bytes > cache_bytes:
+                break
+
+            self._pinned.update(rendered)
+            self.pinned_bytes += level_bytes
+
+        self._recent = LRUCache(cache_bytes - self.pinned_bytes)
+
+    '''
+        Gets the proof of a user as get_proof of the tree does, or None if there is no user with that id.
+    '''
+    def get_proof(self, id: str) -> Optional[list[ProofStep]]:
+        if self._get_slot(id) is None:
+            return None
+
+        return self.tree.get_proof(id)
+
+    '''
+        Gets the JSON body of the response with the proof of a user in the given format (see PROOF_FORMATS),
+        or None if there is no user with that id.
+    '''
+    def render_proof(self, id: str, proof_format: str = 'text') -> Optional[bytes]:
+        key = (id, proof_format)
+        body = self._recent.get(key)
+        if body is not None:
+            return body
+
+        slot = self._get_slot(id)
+        if slot is None:
+            return None
+
+        # The siblings of the nodes in the path from the leaf to the root, a sibling with an even index is on the left
+        siblings = []
+        index = slot
+        while index > 1:
+            siblings.append(index ^ 1)
+            index = index // 2
+
+        if proof_format == 'binary':
+            # Hashes have the size of the hashes of the tree, or of EMPTY_NODE_HASH if there are no steps, as in encode_proof
+            header = encode_proof_header([sibling % 2 == 0 for sibling in siblings], self.hash_size if siblings else len(EMPTY_NODE_HASH))
+            data = header + b''.join([self._get_step(sibling, True) for sibling in siblings])
+            rendered = base64.b64encode(data).decode('ascii')
+        else:
+            rendered = f"[{','.join([self._get_step(sibling, False) for sibling in siblings])}]"
+
+        body = _to_json(dict({ 'id': id, 'format': proof_format, 'proof': rendered }))
+        self._recent.put(key, body)
+
+        return body
+
+    def _get_slot(self, id: str) -> Optional[int]:
+        return self.tree.leaves_map.get(self.tree.get_leaf_hash(id))
+
+    def _get_step(self, index: int, binary: bool):
+        rendered = self._pinned.get(index)
+        if rendered is not None:
+            return rendered[1] if binary else rendered[0]
+
+        step = self.tree.get_proof_step(index)
+        return step.to_bytes(self.dictionary) if binary else f'{{{step.to_string()}}}'
+
+    def _render_step(self, index: int) -> tuple[str, bytes]:
+        step = self.tree.get_proof_step(index)
+        return f'{{{step.to_string()}}}', step.to_bytes(self.dictionary)
+
+'''
+    Handles the requests of a connection until the client closes it. Connections are kept alive for
+    HTTP/1.1 clients unless they send 'Connection: close'. Requests are answered in order:
+
+        - GET /root: the root hash, root balances and hash algorithm, as the root file of verify.py.
+        - GET /proof/<id>?format=text|binary: the proof of a user.
+'''
+async def handle_connection(renderer: ProofRenderer, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+
+            lines = head.decode('latin-1').split('\r\n')
+            request_line = lines[0].split(' ')
+            headers = dict(line.split(':', 1) for line in lines[1:] if ':' in line)
+            connection = next((value.strip().lower() for name, value in headers.items() if name.strip().lower() == 'connection'), '')
+
+            if len(request_line) != 3:
+                status, body = 400, _error_body("Malformed request line")
+                keep_alive = False
+            else:
+                method, target, version = request_line
+                status, body = _route(renderer, method, target)
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+
+            if not keep_alive:
+                return
+    except ConnectionError:
+        return
+    finally:
+        writer.close()
+
+def _route(renderer: ProofRenderer, method: str, target: str) -> tuple[int, bytes]:
+    if method != 'GET':
+        return 405, _error_body("Only GET requests are supported")
+
+    url = urlsplit(target)
+
+    if url.path == '/root':
+        return 200, renderer.root_body
+
+    if url.path.startswith('/proof/'):
+        proof_format = parse_qs(url.query).get('format', ['text'])[0]
+        if proof_format not in PROOF_FORMATS:
+            return 400, _error_body(f"Unknown proof format {proof_format}")
+
+        body = renderer.render_proof(unquote(url.path[len('/proof/'):]), proof_format)
+        return (200, body) if body is not None else (404, _error_body("Unknown id"))
+
+    return 404, _error_body("Not found")
+
+def _error_body(message: str) -> bytes:
+    return _to_json(dict({ 'error': message }))
+
+def _to_json(value: dict) -> bytes:
+    return json.dumps(value, separators = (',', ':')).encode('utf-8')
+
+'''
+    Serves the proofs of a tree on the given host and port until the task is cancelled. When reuse_port is set,
+    other processes can listen on the same port and the connections are balanced among them by the kernel.
+'''
+async def serve(renderer: ProofRenderer, host: str, port: int, reuse_port: bool = False) -> None:
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(renderer, reader, writer), host, port,
+        limit = MAX_HEAD_SIZE, reuse_port = reuse_port or None, backlog = 4096
+    )
+
+    async with server:
+        await server.serve_forever()
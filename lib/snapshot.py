@@ -0,0 +1,220 @@
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Iterable, Iterator
+from lib.storage import NodeStore, TreeStore, ABSENT, level_size
+from lib.errors import require
+
+SNAPSHOT_MAGIC: bytes = b'POLT'
+SNAPSHOT_VERSION: int = 4
+
+# Magic, version, hash size, height of the tree, number of leaves, number of positions given (see
+# MerkleSumTree.positions_count), number of columns, length of the hash type and length of the salt
+SNAPSHOT_HEADER = struct.Struct('<4sHHQQQIHI')
+# Length of the currency name and bytes per amount of a column
+SNAPSHOT_COLUMN = struct.Struct('<HB')
+
+# Amounts are stored as 64 bit integers, or as 128 bit integers for the columns where they do not fit
+NARROW_WIDTH: int = 8
+WIDE_WIDTH: int = 16
+
+'''
+    Binary snapshot of a MerkleSumTree. Every section starts at a multiple of 8 bytes, all integers are little endian:
+
+        - The header, the hash type, the salt and the name and width of each balance column.
+        - The hashes of the stored nodes of each level of the TreeStore, from the leaves to the root, hash_size bytes each.
+        - The leaf positions (see MerkleSumTree.leaf_positions), 8 bytes each.
+        - The slots of the leaves sorted by leaf hash, 8 bytes each, used to find a leaf without a map.
+        - One column per currency with the amount of every stored node, in the same order as the hashes and
+          ABSENT for the nodes without the currency.
+
+    The empty nodes are not stored, the number of stored nodes of each level follows from the number of leaves.
+    The hashes, positions and narrow columns are read as views of the memory mapped file, so loading a
+    snapshot does not depend on the size of the tree.
+'''
+
+@dataclass
+class Snapshot:
+    hash_type: str
+    salt: str
+    levels: list[NodeStore]
+    leaf_positions: Sequence[int]
+    positions_count: int
+    sorted_slots: Sequence[int]
+
+class WideColumn(Sequence):
+    '''
+        Read only column of 128 bit amounts stored in a buffer.
+    '''
+    def __init__(self, buffer: memoryview) -> None:
+        self._buffer = buffer
+
+    def __len__(self) -> int:
+        return len(self._buffer) // WIDE_WIDTH
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        return int.from_bytes(self._buffer[index * WIDE_WIDTH:(index + 1) * WIDE_WIDTH], 'little', signed = True)
+
+class LeafIndex(Mapping):
+    '''
+        Read only map from leaf hash to the slot of the leaf in the tree, backed by the slots of the
+        leaves sorted by their hash. A lookup is a binary search over the hashes of the tree.
+    '''
+    def __init__(self, tree: TreeStore, slots: Sequence[int]) -> None:
+        self._slots = slots
+        self._hashes = _SlotHashes(tree, slots)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._hashes)
+
+    def __getitem__(self, hash: bytes) -> int:
+        position = bisect_left(self._hashes, hash)
+        if position == len(self._slots) or self._hashes[position] != hash:
+            raise KeyError(hash)
+
+        return self._slots[position]
+
+class _SlotHashes(Sequence):
+    def __init__(self, tree: TreeStore, slots: Sequence[int]) -> None:
+        self._tree = tree
+        self._slots = slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __getitem__(self, position: int) -> bytes:
+        return self._tree.get_hash(self._slots[position])
+
+'''
+    Writes the snapshot of a tree into a file. The leaves_map is used to sort the slots of the leaves by hash.
+'''
+def write_snapshot(
+    file: BinaryIO, hash_type: str, salt: str, tree: TreeStore, leaf_positions: Sequence[int], positions_count: int, leaves_map: Mapping[bytes, int]
+) -> None:
+    currencies = sorted(set(currency for level in tree.levels for currency in level.columns))
+    columns = [
+        (currency, NARROW_WIDTH if all(isinstance(level.columns.get(currency), (array, memoryview, type(None))) for level in tree.levels) else WIDE_WIDTH)
+        for currency in currencies
+    ]
+
+    def get_amounts(currency: str, width: int) -> Iterator[bytes]:
+        for level in tree.levels:
+            column = level.columns.get(currency)
+            amounts = column[:level.size] if column is not None else array('q', [ABSENT]) * level.size
+
+            if width == NARROW_WIDTH:
+                yield amounts.tobytes()
+            else:
+                yield b''.join([amount.to_bytes(WIDE_WIDTH, 'little', signed = True) for amount in amounts])
+
+    write_snapshot_sections(
+        file, hash_type, salt, tree.levels[0].hash_size, tree.height, tree.leaves_count, positions_count, columns,
+        [level.hashes[:level.size * level.hash_size] for level in tree.levels],
+        [array('q', leaf_positions).tobytes()],
+        [array('q', [slot for _, slot in sorted(leaves_map.items())]).tobytes()],
+        get_amounts
+    )
+
+'''
+    Writes a snapshot given its sections as chunks of bytes, so that they can be streamed from elsewhere (see
+    lib/external.py). Each column is given as its currency and width, and get_amounts yields the chunks of the
+    amounts of a column, of every level from the leaves to the root.
+'''
+def write_snapshot_sections(
+    file: BinaryIO, hash_type: str, salt: str, hash_size: int, height: int, leaves_count: int, positions_count: int, columns: list[tuple[str, int]],
+    hashes: Iterable[bytes], leaf_positions: Iterable[bytes], sorted_slots: Iterable[bytes], get_amounts: Callable[[str, int], Iterable[bytes]]
+) -> None:
+    require(sys.byteorder == 'little', "Snapshots can only be written on little endian machines")
+
+    hash_type_bytes, salt_bytes = hash_type.encode('utf-8'), salt.encode('utf-8')
+
+    file.write(SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, hash_size, height, leaves_count, positions_count, len(columns), len(hash_type_bytes), len(salt_bytes)
+    ))
+    file.write(hash_type_bytes + salt_bytes)
+    for currency, width in columns:
+        name = currency.encode('utf-8')
+        file.write(SNAPSHOT_COLUMN.pack(len(name), width) + name)
+    _pad(file)
+
+    for chunk in hashes:
+        file.write(chunk)
+    _pad(file)
+
+    for chunk in leaf_positions:
+        file.write(chunk)
+    for chunk in sorted_slots:
+        file.write(chunk)
+
+    for currency, width in columns:
+        for chunk in get_amounts(currency, width):
+            file.write(chunk)
+
+'''
+    Memory maps a snapshot written by write_snapshot. The file stays mapped as long as the views
+    of the returned snapshot are referenced.
+'''
+def read_snapshot(path: str) -> Snapshot:
+    require(sys.byteorder == 'little', "Snapshots can only be read on little endian machines")
+
+    with open(path, 'rb') as file:
+        buffer = memoryview(mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ))
+
+    magic, version, hash_size, height, leaves_count, positions_count, columns_count, hash_type_length, salt_length = (
+        SNAPSHOT_HEADER.unpack_from(buffer, 0)
+    )
+    require(magic == SNAPSHOT_MAGIC and version == SNAPSHOT_VERSION, "Unsupported tree snapshot file")
+
+    offset = SNAPSHOT_HEADER.size
+    hash_type = bytes(buffer[offset:offset + hash_type_length]).decode('utf-8')
+    offset += hash_type_length
+    salt = bytes(buffer[offset:offset + salt_length]).decode('utf-8')
+    offset += salt_length
+
+    column_headers = []
+    for _ in range(columns_count):
+        name_length, width = SNAPSHOT_COLUMN.unpack_from(buffer, offset)
+        offset += SNAPSHOT_COLUMN.size
+        column_headers.append((bytes(buffer[offset:offset + name_length]).decode('utf-8'), width))
+        offset += name_length
+
+    level_sizes = [level_size(leaves_count, level) for level in range(height + 1)]
+    nodes_count = sum(level_sizes)
+
+    hashes_offset = _align(offset)
+    positions_offset = _align(hashes_offset + nodes_count * hash_size)
+    slots_offset = positions_offset + leaves_count * 8
+    offset = slots_offset + leaves_count * 8
+    require(offset + sum(nodes_count * width for _, width in column_headers) <= len(buffer), "Truncated tree snapshot file")
+
+    leaf_positions = buffer[positions_offset:slots_offset].cast('q')
+    sorted_slots = buffer[slots_offset:offset].cast('q')
+
+    levels = []
+    for size in level_sizes:
+        levels.append(NodeStore.from_buffers(size, hash_size, buffer[hashes_offset:hashes_offset + size * hash_size], dict()))
+        hashes_offset += size * hash_size
+
+    for currency, width in column_headers:
+        for level in levels:
+            column = buffer[offset:offset + level.size * width]
+            level.columns[currency] = column.cast('q') if width == NARROW_WIDTH else WideColumn(column)
+            offset += level.size * width
+
+    return Snapshot(hash_type, salt, levels, leaf_positions, positions_count, sorted_slots)
+
+def _align(offset: int) -> int:
+    return -(-offset // 8) * 8
+
+def _pad(file: BinaryIO) -> None:
+    file.write(bytes(_align(file.tell()) - file.tell()))
@@ -0,0 +1,349 @@
+from array import array
+from collections.abc import Sequence
+from collections import OrderedDict
+from typing import Optional, Union
+
+# Value stored in a balance column for the nodes that do not hold that currency.
+# Balances can't be negative so it never collides with an actual amount.
+ABSENT: int = -1
+
+# Minimum number of nodes allocated when a store grows
+MIN_GROWTH: int = 1024
+
+class NodeStore():
+    hash_size: int
+    size: int
+    capacity: int
+    hashes: bytearray
+    columns: dict[str, array]
+
+    '''
+        Columnar storage for the nodes of a tree. The hashes are stored in a single buffer with a stride
+        of hash_size bytes and the balances in one column per currency, where each amount is an integer
+        scaled by 10^DECIMAL_PRECISION. A currency that a node does not hold is stored as ABSENT, which
+        keeps apart a missing currency from a currency with a zero balance.
+
+        Columns are signed 64 bit arrays. If an amount does not fit in 64 bits the whole column is turned
+        into a list of python integers.
+
+        The buffers may hold more nodes than the size of the store (its capacity) so that a store can
+        grow one node at a time.
+    '''
+    def __init__(self, size: int, hash_size: int = 32) -> None:
+        self.hash_size = hash_size
+        self.size = size
+        self.capacity = size
+        self.hashes = bytearray(size * hash_size)
+        self.columns = dict()
+
+    '''
+        Creates a store over existing buffers holding size nodes, such as views of a memory mapped file.
+        Columns can be any sequence of integers. The store is read only if the buffers are.
+    '''
+    @classmethod
+    def from_buffers(cls, size: int, hash_size: int, hashes, columns: dict) -> 'NodeStore':
+        store = cls(0, hash_size)
+        store.size = store.capacity = size
+        store.hashes = hashes
+        store.columns = columns
+
+        return store
+
+    def __len__(self) -> int:
+        return self.size
+
+    '''
+        Adds count empty nodes at the end of the store. When the buffers are full they are extended
+        by an eighth of their capacity at least.
+    '''
+    def grow(self, count: int) -> None:
+        self.size += count
+        if self.size > self.capacity:
+            self._reallocate(max(self.size, self.capacity + self.capacity // 8, MIN_GROWTH))
+
+    '''
+        Removes the last count nodes of the store, leaving them empty in case the store grows again.
+    '''
+    def shrink(self, count: int) -> None:
+        self.size -= count
+        self.hashes[self.size * self.hash_size:(self.size + count) * self.hash_size] = bytes(count * self.hash_size)
+
+        for currency, column in self.columns.items():
+            column[self.size:self.size + count] = array('q', [ABSENT]) * count if isinstance(column, array) else [ABSENT] * count
+
+    def _reallocate(self, capacity: int) -> None:
+        extra = capacity - self.capacity
+        self.hashes.extend(bytes(extra * self.hash_size))
+
+        for column in self.columns.values():
+            column.extend(array('q', [ABSENT]) * extra if isinstance(column, array) else [ABSENT] * extra)
+
+        self.capacity = capacity
+
+    def _new_column(self, currency: str) -> array:
+        self.columns[currency] = array('q', [ABSENT]) * self.capacity
+        return self.columns[currency]
+
+    def get_hash(self, index: int) -> bytes:
+        return bytes(self.hashes[index * self.hash_size:(index + 1) * self.hash_size])
+
+    def set_hash(self, index: int, hash: bytes) -> None:
+        self.hashes[index * self.hash_size:index * self.hash_size + len(hash)] = hash
+
+    def get_balances(self, index: int) -> dict[str, int]:
+        balances = dict()
+        for currency, column in self.columns.items():
+            amount = column[index]
+            if amount != ABSENT:
+                balances[currency] = amount
+
+        return balances
+
+    def set_balances(self, index: int, balances: dict[str, int]) -> None:
+        for currency, amount in balances.items():
+            column = self.columns.get(currency)
+            if column is None:
+                column = self._new_column(currency)
+
+            try:
+                column[index] = amount
+            except OverflowError:
+                self.columns[currency] = list(column)
+                self.columns[currency][index] = amount
+
+    '''
+        Removes every balance of a node, as if it did not hold any currency.
+    '''
+    def clear_balances(self, index: int) -> None:
+        for column in self.columns.values():
+            column[index] = ABSENT
+
+    '''
+        Sets the amounts of a currency for consecutive nodes starting at index, None
+        meaning that the node does not hold the currency.
+    '''
+    def set_column(self, currency: str, index: int, amounts: list[Optional[int]]) -> None:
+        self.set_values(currency, index, to_column_values(amounts))
+
+    '''
+        Sets the stored values of a currency for consecutive nodes starting at index, as
+        to_column_values gives them.
+    '''
+    def set_values(self, currency: str, index: int, values: Union[array, list[int]]) -> None:
+        column = self.columns.get(currency)
+        if column is None:
+            column = self._new_column(currency)
+
+        if isinstance(column, array) and not isinstance(values, array):
+            column = self.columns[currency] = list(column)
+
+        column[index:index + len(values)] = values
+
+    '''
+        Copies count consecutive nodes of another store starting at source_index into this store
+        starting at index.
+    '''
+    def copy_from(self, source: 'NodeStore', source_index: int, index: int, count: int) -> None:
+        self.hashes[index * self.hash_size:(index + count) * self.hash_size] = (
+            source.hashes[source_index * self.hash_size:(source_index + count) * self.hash_size]
+        )
+
+        for currency, source_column in source.columns.items():
+            column = self.columns.get(currency)
+            if column is None:
+                column = self._new_column(currency)
+
+            values = source_column[source_index:source_index + count]
+            if isinstance(column, array) and not isinstance(values, array):
+                column = self.columns[currency] = list(column)
+            column[index:index + count] = values if isinstance(column, array) else list(values)
+
+    '''
+        Copies into consecutive nodes starting at index the nodes of another store at the given positions.
+        Positions beyond the size of the other store are copied as empty nodes.
+    '''
+    def gather_from(self, source: 'NodeStore', positions: Sequence[int], index: int) -> None:
+        source_size = len(source)
+        empty_hash = bytes(self.hash_size)
+        source_hashes = memoryview(source.hashes)
+
+        self.hashes[index * self.hash_size:(index + len(positions)) * self.hash_size] = b''.join([
+            source_hashes[position * self.hash_size:(position + 1) * self.hash_size] if position < source_size else empty_hash
+            for position in positions
+        ])
+
+        for currency, source_column in source.columns.items():
+            column = self.columns.get(currency)
+            if column is None:
+                column = self._new_column(currency)
+
+            values = [source_column[position] if position < source_size else ABSENT for position in positions]
+            if not isinstance(source_column, array) and isinstance(column, array):
+                column = self.columns[currency] = list(column)
+            column[index:index + len(positions)] = array('q', values) if isinstance(column, array) else values
+
+class TreeStore():
+    height: int
+    levels: list[NodeStore]
+    empty_hashes: list[bytes]
+
+    '''
+        Storage of a tree with 2^height leaves where only the first leaves are real and the rest are empty. Every
+        node whose leaves are all empty is itself an empty node, which only depends on its height, so those nodes
+        are not stored: level h (being 0 the leaves) stores the first ceil(leaves_count / 2^h) nodes in a NodeStore,
+        and the rest of its nodes have the hash empty_hashes[h] and no balances.
+
+        Nodes are addressed by their index in the flat list of the tree, where node i is the parent of nodes
+        2i and 2i+1 and the root is node 1.
+    '''
+    def __init__(self, height: int, leaves_count: int, empty_hashes: list[bytes], hash_size: int = 32) -> None:
+        self.height = height
+        self.empty_hashes = empty_hashes
+        self.levels = [NodeStore(level_size(leaves_count, level), hash_size) for level in range(height + 1)]
+
+    '''
+        Creates a store over the given levels, which must have the sizes of a tree with len(levels[0]) leaves.
+    '''
+    @classmethod
+    def from_levels(cls, levels: list[NodeStore], empty_hashes: list[bytes]) -> 'TreeStore':
+        store = cls(len(levels) - 1, 0, empty_hashes)
+        store.levels = levels
+
+        return store
+
+    @property
+    def leaves_count(self) -> int:
+        return len(self.levels[0])
+
+    @property
+    def total_leaves(self) -> int:
+        return 1 << self.height
+
+    '''
+        Changes the number of real leaves, adding empty nodes at the end of each level or removing its last nodes.
+    '''
+    def resize(self, leaves_count: int) -> None:
+        for level, store in enumerate(self.levels):
+            size = level_size(leaves_count, level)
+            if size > len(store):
+                store.grow(size - len(store))
+            elif size < len(store):
+                store.shrink(len(store) - size)
+
+    '''
+        Gets the level and the position in that level of a node given its index.
+    '''
+    def locate(self, index: int) -> tuple[int, int]:
+        depth = index.bit_length() - 1
+        return self.height - depth, index - (1 << depth)
+
+    def get_index(self, level: int, position: int) -> int:
+        return (1 << (self.height - level)) + position
+
+    def is_stored(self, index: int) -> bool:
+        level, position = self.locate(index)
+        return position < len(self.levels[level])
+
+    def get_hash(self, index: int) -> bytes:
+        level, position = self.locate(index)
+        store = self.levels[level]
+
+        return store.get_hash(position) if position < len(store) else self.empty_hashes[level]
+
+    def get_balances(self, index: int) -> dict[str, int]:
+        level, position = self.locate(index)
+        store = self.levels[level]
+
+        return store.get_balances(position) if position < len(store) else dict()
+
+    def set_hash(self, index: int, hash: bytes) -> None:
+        level, position = self.locate(index)
+        self.levels[level].set_hash(position, hash)
+
+    def set_balances(self, index: int, balances: dict[str, int]) -> None:
+        level, position = self.locate(index)
+        self.levels[level].set_balances(position, balances)
+
+    def clear_balances(self, index: int) -> None:
+        level, position = self.locate(index)
+        self.levels[level].clear_balances(position)
+
+'''
+    Turns the amounts of a currency, None meaning that the node does not hold it, into the values stored in a
+    column: a signed 64 bit array, or a list if an amount does not fit.
+'''
+def to_column_values(amounts: list[Optional[int]]) -> Union[array, list[int]]:
+    values = [ABSENT if amount is None else amount for amount in amounts]
+    try:
+        return array('q', values)
+    except OverflowError:
+        return values
+
+'''
+    Gets the number of nodes stored at a level of a tree with the given number of leaves, where the leaves
+    are level 0. The empty nodes at the right of each level are not stored.
+'''
+def level_size(leaves_count: int, level: int) -> int:
+    return (leaves_count + (1 << level) - 1) >> level
+
+class EncodingCache():
+    pinned_levels: int
+
+    '''
+        Cache of the stringified balances (see balance.format_balance) of the nodes of a tree by index. The
+        nodes of the first pinned_levels levels are part of most of the proofs, so they are kept as long as the
+        cache lives. The rest of the nodes are not kept: the passes over the tree, such as writing its nodes or
+        iterating its proofs, read each of them once, so they would be evicted before being read again.
+    '''
+    def __init__(self, pinned_levels: int = 16) -> None:
+        self.pinned_levels = pinned_levels
+        self._pinned = dict()
+
+    def is_pinned(self, index: int) -> bool:
+        return index < 1 << self.pinned_levels
+
+    def get(self, index: int) -> Optional[str]:
+        return self._pinned.get(index)
+
+    def discard(self, index: int) -> None:
+        self._pinned.pop(index, None)
+
+    def put(self, index: int, encoded: str) -> None:
+        if self.is_pinned(index):
+            self._pinned[index] = encoded
+
+class LRUCache():
+    max_bytes: int
+
+    '''
+        Least recently used cache of strings or bytes by key, holding values of up to max_bytes in total.
+    '''
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._recent = OrderedDict()
+        self._recent_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def get(self, key):
+        value = self._recent.get(key)
+        if value is not None:
+            self._recent.move_to_end(key)
+
+        return value
+
+    def discard(self, key) -> None:
+        previous = self._recent.pop(key, None)
+        if previous is not None:
+            self._recent_bytes -= len(previous)
+
+    def put(self, key, value) -> None:
+        self.discard(key)
+
+        self._recent[key] = value
+        self._recent_bytes += len(value)
+
+        while self._recent_bytes > self.max_bytes:
+            _, evicted = self._recent.popitem(last = False)
+            self._recent_bytes -= len(evicted)
@@ -0,0 +1,233 @@
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Optional
+from lib.merkle import EMPTY_NODE_HASH, get_next_pow_2, get_empty_hashes, hash_children
+from lib.balance import DECIMAL_PRECISION, parse_units, format_balance, combine_units
+from lib.storage import level_size
+from lib.errors import require
+
+# Number of parents checked by each task
+CHECK_CHUNK_SIZE: int = 2 ** 15
+
+# Number of rows between two entries of the index of the rows
+INDEX_INTERVAL: int = 2 ** 12
+
+'''
+    Integrity check of a published tree file, the output of the tree of main.py: one row 'hash,balances' per stored
+    node, from top to bottom and from left to right (see MerkleSumTree.get_nodes). The number of rows tells the number
+    of leaves, so the rows of each level are known without reading them. Every parent is checked against its two
+    children, which are read from the level below, so the file is checked in chunks of parents that are independent
+    of each other and can be checked in parallel, each one reading its rows from the file.
+'''
+
+@dataclass
+class RowIndex:
+    '''
+        Sparse index of the rows of a file: the offset of every INDEX_INTERVAL-th row, so that a row is
+        reached by seeking to the offset before it and skipping less than INDEX_INTERVAL rows.
+    '''
+    rows_count: int
+    offsets: list[int]
+
+    def locate(self, row: int) -> tuple[int, int]:
+        return self.offsets[row // INDEX_INTERVAL], row % INDEX_INTERVAL
+
+'''
+    A node whose hash or balances do not match its children, or which could not be read, given by its index
+    in the tree (see MerkleSumTree) and the reason.
+'''
+@dataclass
+class Mismatch:
+    index: int
+    message: str
+
+'''
+    Reads the file once counting its rows and indexing them.
+'''
+def index_rows(file: BinaryIO) -> RowIndex:
+    offsets = []
+    rows_count = offset = 0
+
+    for line in file:
+        if rows_count % INDEX_INTERVAL == 0:
+            offsets.append(offset)
+        offset += len(line)
+        rows_count += 1
+
+    return RowIndex(rows_count, offsets)
+
+'''
+    Gets the number of leaves of the tree whose file has the given number of rows, that is the number of leaves
+    whose levels store that many nodes in total. Raises an exception if no tree has that number of rows.
+'''
+def get_leaves_count(rows_count: int) -> int:
+    low, high = 0, rows_count
+    while low < high:
+        middle = (low + high) // 2
+        if _count_rows(middle) < rows_count:
+            low = middle + 1
+        else:
+            high = middle
+
+    require(_count_rows(low) == rows_count, f"No tree has {rows_count} rows")
+    return low
+
+def _count_rows(leaves_count: int) -> int:
+    height = get_next_pow_2(leaves_count).bit_length() - 1
+    return sum(level_size(leaves_count, level) for level in range(height + 1))
+
+'''
+    Checks the tree file at path against the published root hash and balances, checking in a pool of workers every
+    parent against its children: its hash must be the hash of the children and its balances the sum of theirs, with
+    the same format. The leaves must have positive balances in the same format. Only the rows of the chunks being
+    checked are held in memory.
+
+    Returns the mismatch of the lowest index, so the first one from top to bottom, or None if the tree is valid.
+    If on_chunk is given it is called with the number of nodes checked after each chunk.
+'''
+def check_tree_file(
+    path: str, root_hash: bytes, root_balances: str, hash_type: str = 'sha256', workers: int = 1,
+    on_chunk: Optional[Callable[[int], None]] = None
+) -> Optional[Mismatch]:
+    with open(path, 'rb') as file:
+        index = index_rows(file)
+
+        if index.rows_count == 0:
+            return None if root_hash == EMPTY_NODE_HASH and root_balances == '' else Mismatch(1, "The tree is empty")
+
+        leaves_count = get_leaves_count(index.rows_count)
+        file.seek(0)
+        root = _parse_row(file.readline())
+
+    if root is None or root != (root_hash, root_balances):
+        return Mismatch(1, "Root is not equal to the published root")
+
+    height = get_next_pow_2(leaves_count).bit_length() - 1
+    empty_hashes = get_empty_hashes(getattr(hashlib, hash_type), height)
+    # Row of the first node of each level, after the rows of the levels above
+    level_rows = [sum(level_size(leaves_count, above) for above in range(level + 1, height + 1)) for level in range(height + 1)]
+
+    tasks = []
+    for level in range(height, 0, -1):
+        for start in range(0, level_size(leaves_count, level), CHECK_CHUNK_SIZE):
+            count = min(CHECK_CHUNK_SIZE, level_size(leaves_count, level) - start)
+            tasks.append((
+                path, hash_type, level, height, start, count, level_size(leaves_count, level - 1), empty_hashes[level - 1],
+                index.locate(level_rows[level] + start), index.locate(level_rows[level - 1] + 2 * start)
+            ))
+
+    mismatches = []
+    def add_result(result: tuple[int, Optional[Mismatch]]):
+        count, mismatch = result
+        if mismatch is not None:
+            mismatches.append(mismatch)
+        if on_chunk is not None:
+            on_chunk(count)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            pending = deque()
+            for task in tasks:
+                pending.append(executor.submit(check_chunk, *task))
+                if len(pending) >= 2 * workers:
+                    add_result(pending.popleft().result())
+
+            while pending:
+                add_result(pending.popleft().result())
+    else:
+        for task in tasks:
+            add_result(check_chunk(*task))
+
+    return min(mismatches, key = lambda mismatch: mismatch.index, default = None)
+
+'''
+    Checks count parents of a level starting at the given position against their children, given the height of
+    the tree, the number of nodes of the level below, the hash of its empty node and where the rows of the first
+    parent and child are (see RowIndex.locate). Returns the number of parents checked and the first mismatch, if any.
+'''
+def check_chunk(
+    path: str, hash_type: str, level: int, height: int, start: int, count: int, children_count: int, empty_hash: bytes,
+    parents_location: tuple[int, int], children_location: tuple[int, int]
+) -> tuple[int, Optional[Mismatch]]:
+    hash_function = getattr(hashlib, hash_type)
+
+    with open(path, 'rb') as parents_file, open(path, 'rb') as children_file:
+        _seek_row(parents_file, parents_location)
+        _seek_row(children_file, children_location)
+
+        for position in range(start, start + count):
+            index = (1 << (height - level)) + position
+            child_positions = [2 * position, 2 * position + 1]
+
+            try:
+                parent = _read_row(parents_file)
+                children = [_read_row(children_file) if child < children_count else (empty_hash, '') for child in child_positions]
+                balances = [_parse_balances(encoded) for _, encoded in children]
+
+                if level == 1:
+                    for child, (_, encoded), child_balances in zip(child_positions, children, balances):
+                        error = _check_leaf(encoded, child_balances) if child < children_count else None
+                        if error is not None:
+                            return position - start, Mismatch(2 * index + child % 2, error)
+
+                (left_hash, left_encoded), (right_hash, right_encoded) = children
+                require(
+                    parent[0] == hash_children(hash_function, left_hash, left_encoded, right_hash, right_encoded),
+                    "Hash is not equal to the hash of its children"
+                )
+                require(parent[1] == format_balance(combine_units(*balances)), "Balances are not equal to the sum of its children")
+            except Exception as e:
+                return position - start, Mismatch(index, str(e) or type(e).__name__)
+
+    return count, None
+
+def _check_leaf(encoded: str, balances: dict[str, int]) -> Optional[str]:
+    if not all(amount >= 0 for amount in balances.values()):
+        return "At least one balance was negative"
+    if format_balance(balances) != encoded:
+        return "Balances are not in the format of the tree"
+
+    return None
+
+def _seek_row(file: BinaryIO, location: tuple[int, int]) -> None:
+    offset, skip = location
+    file.seek(offset)
+    for _ in range(skip):
+        file.readline()
+
+def _read_row(file: BinaryIO) -> tuple[bytes, str]:
+    row = _parse_row(file.readline())
+    require(row is not None, "Row is missing or malformed")
+
+    return row
+
+def _parse_row(line: bytes) -> Optional[tuple[bytes, str]]:
+    fields = line.decode('utf-8').rstrip('\r\n').split(',')
+    if len(fields) != 2:
+        return None
+
+    return bytes.fromhex(fields[0]), fields[1]
+
+'''
+    Parses stringified balances into units keeping the zero amounts, which are part of the stringified balances.
+    Amounts with exactly DECIMAL_PRECISION decimals, as the tree writes all but the smallest ones, are read
+    as integers without going through parse_units.
+'''
+def _parse_balances(encoded: str) -> dict[str, int]:
+    balances = dict()
+    if encoded == '':
+        return balances
+
+    for entry in encoded.split('|'):
+        currency, separator, amount = entry.partition(':')
+        require(separator != '', f"Invalid balance {entry}")
+
+        whole, _, fraction = amount.partition('.')
+        if len(fraction) == DECIMAL_PRECISION and whole.isdecimal() and fraction.isdecimal():
+            balances[currency] = int(whole + fraction)
+        else:
+            balances[currency] = parse_units(amount)
+
+    return balances
@@ -0,0 +1,133 @@
+import hashlib
+from typing import Callable, Iterator, Optional
+from lib.merkle import Side
+from lib.errors import require
+from lib.balance import decode_balance_units, format_balance, combine_units
+from lib.binary_proof import CurrencyDictionary, decode_proof_header, iter_binary_proof
+
+_STEP_SEPARATOR: str = '},{'
+
+'''
+    Gets the text between the outer brackets of a stringified proof (see merkle.proof_to_string), that is
+    the steps without their first opening and last closing brace.
+'''
+def proof_body(proof_str: str) -> str:
+    require(proof_str.startswith('[') and proof_str.endswith(']'), "Invalid proof")
+    steps = proof_str[1:-1]
+
+    if steps == '':
+        return steps
+
+    require(steps.startswith('{') and steps.endswith('}'), "Invalid proof")
+    return steps[1:-1]
+
+'''
+    Parses a stringified proof step 'side,hash,balances' without braces into its side, hash and balances.
+'''
+def parse_step(step_str: str) -> tuple[Side, bytes, str]:
+    side, hash, balances = step_str.split(',')
+    return Side[side], bytes.fromhex(hash), balances
+
+class ProofVerifier():
+    '''
+        Verifies many stringified proofs against the same root, with the same checks as merkle.verify_merkle_proof_from_leaf
+        but with the balances in units (see lib/balance.py).
+
+        Proofs of leaves that are close in the tree share their last steps, so the nodes they compute converge. Once
+        a proof is verified, the verifier keeps for each node it computed the key of the text of the steps that took
+        that node to the root, its sha256 digest and its length, so every entry has the same size however long the proof. A node hash commits to the hashes and stringified balances of its children, so when a later proof
+        reaches a known node and its remaining steps are the same text, it reaches the root in the same way and the
+        remaining steps are neither parsed nor hashed. The cache holds up to cache_size nodes and is emptied when full.
+
+        Binary proofs (see lib/binary_proof.py) are verified in the same way given the currency dictionary of the
+        audit, keeping the key of the bytes and the sides of the remaining steps instead of their text.
+    '''
+    def __init__(
+        self, root_hash: bytes, root_balances: dict[str, int], hash_type: str = 'sha256', cache_size: int = 2 ** 16,
+        dictionary: Optional[CurrencyDictionary] = None
+    ) -> None:
+        self.root_hash = root_hash
+        self.root_balances = root_balances
+        self.hash_function = getattr(hashlib, hash_type)
+        self.cache_size = cache_size
+        self.dictionary = dictionary
+        self._verified: dict[bytes, object] = dict()
+
+    '''
+        Verifies the stringified proof of a leaf given its hash and its balances in units, raising an exception
+        if it is not valid.
+    '''
+    def verify(self, leaf_hash: bytes, leaf_balances: dict[str, int], proof_str: str) -> None:
+        body = proof_body(proof_str)
+        self._verify_steps(leaf_hash, leaf_balances, _iter_text_steps(body), lambda offset: _steps_key(str.encode(body[offset:])))
+
+    '''
+        Verifies the binary proof of a leaf given its hash and its balances in units, raising an exception
+        if it is not valid.
+    '''
+    def verify_binary(self, leaf_hash: bytes, leaf_balances: dict[str, int], data: bytes) -> None:
+        require(self.dictionary is not None, "A currency dictionary is needed to verify binary proofs")
+
+        _, _, sides, _ = decode_proof_header(data)
+        steps = (
+            (Side.LEFT if is_left else Side.RIGHT, hash, balances, (offset, step + 1))
+            for step, (is_left, hash, balances, offset) in enumerate(iter_binary_proof(data, self.dictionary))
+        )
+        self._verify_steps(leaf_hash, leaf_balances, steps, lambda position: _steps_key(data[position[0]:], sides >> position[1]))
+
+    '''
+        Computes the nodes from a leaf to the root given the steps of its proof, each one with the side, hash and balances
+        of the sibling and the position where the step ends. The remaining function gets the key of the remaining steps
+        after a position (see _steps_key), which is compared with the key of the remaining steps of a known node.
+    '''
+    def _verify_steps(self, leaf_hash: bytes, leaf_balances: dict[str, int], steps: Iterator[tuple], remaining: Callable) -> None:
+        require(all(amount >= 0 for amount in leaf_balances.values()), "At least one balance was negative")
+
+        hash, balances, encoded = leaf_hash, leaf_balances, format_balance(leaf_balances)
+        computed = []
+
+        for side, step_hash, step_balances, position in steps:
+            step_encoded = format_balance(step_balances)
+
+            if side == Side.RIGHT:
+                hash = self.hash_function(hash + str.encode(encoded) + step_hash + str.encode(step_encoded)).digest()
+            else:
+                hash = self.hash_function(step_hash + str.encode(step_encoded) + hash + str.encode(encoded)).digest()
+
+            remaining_key = self._verified.get(hash)
+            if remaining_key is not None and remaining_key == remaining(position):
+                break
+
+            balances = combine_units(balances, step_balances)
+            encoded = format_balance(balances)
+            computed.append((hash, position))
+        else:
+            require(hash == self.root_hash, "Root hash is not equal to obtained hash")
+            require(balances == self.root_balances, "Root balances are not equal to obtained balances")
+
+        # The nodes computed by this proof lead to the root, either directly or through a known node
+        if len(self._verified) + len(computed) > self.cache_size:
+            self._verified.clear()
+
+        for node_hash, position in computed:
+            self._verified[node_hash] = remaining(position)
+
+'''
+    Gets the key of the remaining steps of a proof given their bytes and any other data they depend on: the sha256
+    digest and the length of the bytes, which take the same size however many steps remain.
+'''
+def _steps_key(steps: bytes, *extra: int) -> tuple:
+    return (hashlib.sha256(steps).digest(), len(steps)) + extra
+
+'''
+    Yields the side, hash and balances in units of each step of the body of a stringified proof, together with
+    the offset where the remaining steps start.
+'''
+def _iter_text_steps(body: str) -> Iterator[tuple[Side, bytes, dict[str, int], int]]:
+    offset = 0
+
+    for step in body.split(_STEP_SEPARATOR) if body else []:
+        side, step_hash, step_balances_str = parse_step(step)
+        offset += len(step) + len(_STEP_SEPARATOR)
+
+        yield side, step_hash, decode_balance_units(step_balances_str), offset
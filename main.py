@@ -1,77 +1,179 @@
 import csv
-from lib.merkle import MerkleSumTree, ProofStep, Leaf, Node, verify_merkle_proof
+from lib.merkle import MerkleSumTree, ProofStep, LeafBatch, verify_merkle_proof_from_leaf, proof_to_string, encode_proof
+from lib.binary_proof import CurrencyDictionary, PROOFS_FILE_MAGIC, encode_proof_record
+from lib.balance import decode_balance_columns
+from lib.proof_index import ShardedProofWriter
+from lib.metrics import Metrics, phase, iterate
+from lib.external import build_snapshot, SpilledIds
+from lib.columnar import read_columnar_balances, COLUMNAR_FORMATS
+from typing import Callable, Iterable, Iterator, Optional, Sequence, TextIO, TypeVar, Union
+from itertools import islice
 import argparse
+import random
+import sys
 
-def get_merkle_proofs(tree: MerkleSumTree, user_ids: list[str]) -> dict[str, list[ProofStep]]:
-    proofs = {}
+# Number of rows of the input file that are decoded at once, and of rows of the outputs written at once
+CHUNK_SIZE = 10000
 
-    for id in user_ids:
-        proof = tree.get_proof(id)
-        proofs[id] = proof
+T = TypeVar('T')
+
+'''
+    Yields the id and the proof of every user in the order of the leaves of the tree,
+    where user_ids holds the ids in the same order as the leaves were supplied.
+'''
+def get_merkle_proofs(tree: MerkleSumTree, user_ids: Sequence[str]) -> Iterator[tuple[str, list[ProofStep]]]:
+    for position, proof in tree.iter_proofs():
+        yield user_ids[position], proof
 
-    return proofs
+'''
+    Checks every node of the tree against its children in a single pass, then verifies the proofs
+    of a random sample of the users, each user being picked with probability sample_rate.
+'''
+def verify_tree(tree: MerkleSumTree, user_ids: Sequence[str], sample_rate: float = 0.0):
+    tree.verify_nodes()
 
-def verify_merkle_proofs(user_balances: list[Leaf], proofs: dict[str, list[ProofStep]], root_node: Node, audit_id: str):
-    for user_balance in user_balances:
-        verify_merkle_proof(root_node, proofs[user_balance.id], audit_id, user_balance)
+    if sample_rate <= 0:
+        return
+
+    root_node = tree.get_root()
+    for id in user_ids:
+        if sample_rate >= 1 or random.random() < sample_rate:
+            verify_merkle_proof_from_leaf(root_node, tree.get_proof(id), tree.get_leaf(id), tree.hash_type)
+
+'''
+    Gets the function that encodes the proofs of a tree in the given format: stringified proofs, or the bytes of
+    binary proofs (see lib/binary_proof.py) with the currencies of the root as dictionary.
+'''
+def get_proof_formatter(tree: MerkleSumTree, proof_format: str) -> Callable[[list[ProofStep]], Union[str, bytes]]:
+    if proof_format == 'binary':
+        dictionary = CurrencyDictionary(tree.get_root().balances)
+        return lambda proof: encode_proof(proof, dictionary)
+
+    return proof_to_string
+
+'''
+    Reads the leaves of the input file in chunks of rows, so that the tree is built while the file
+    is read and the whole input is never held in memory. The ids of the users are added to user_ids
+    in the same order as they are read.
+'''
+def read_user_balances(file: TextIO, user_ids: list[str], chunk_size: int = CHUNK_SIZE) -> Iterator[LeafBatch]:
+    reader = csv.DictReader(file)
+
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if len(rows) == 0: return
+
+        ids = [row['id'].strip() for row in rows]
+        user_ids.extend(ids)
+
+        yield LeafBatch(ids, decode_balance_columns([row['balances'].strip() for row in rows]))
+
+'''
+    Reads the leaves of the input file in the given format: the CSV file read by read_user_balances or
+    one of the columnar formats of lib/columnar.py.
+'''
+def read_input(path: str, input_format: str, user_ids: list[str]) -> Iterator[LeafBatch]:
+    if input_format != 'csv':
+        yield from read_columnar_balances(path, input_format, user_ids, CHUNK_SIZE)
+        return
+
+    with open(path, 'r') as file:
+        yield from read_user_balances(file, user_ids)
+
+'''
+    Yields the items of an iterable in lists of at most chunk_size items, so that the progress and the
+    phases of a run are updated once per chunk instead of once per item.
+'''
+def chunked(items: Iterable[T], chunk_size: int = CHUNK_SIZE) -> Iterator[list[T]]:
+    iterator = iter(items)
+
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if len(chunk) == 0: return
+
+        yield chunk
+
+def print_progress(phase: str, done: int, total: Optional[int]):
+    print(f"{phase}: {done}" + (f"/{total}" if total is not None else ''), file=sys.stderr, flush=True)
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help='Relative path to the input file', required = True)
+    parser.add_argument('--input-format', choices=['csv'] + COLUMNAR_FORMATS, default='csv', help='Format of the input file, a CSV file with the balances of each user as a string or a columnar file with one integer column per currency')
     parser.add_argument('-o','--output',  nargs='+', help='Relative path for the output files. First path refers to the tree output, second path refers to the proofs output', required=True)
     parser.add_argument('-a','--audit_id',  help='Audit ID for this PoL audit')
+    parser.add_argument('-w','--workers', type=int, default=1, help='Number of processes used to build the tree')
+    parser.add_argument('--snapshot', help='Path where a binary snapshot of the tree is written, which can be loaded with MerkleSumTree.load')
+    parser.add_argument('-s','--shards', type=int, help='Number of files to partition the proofs into. If set, the proofs output is a directory with the files and an index')
+    parser.add_argument('--proof-format', choices=['text', 'binary'], default='text', help='Format of the proofs output, a CSV file of stringified proofs or a file of length prefixed binary proofs')
+    parser.add_argument('--metrics', help='Path where a JSON report with the time of each phase, counters and the peak memory of the run is written')
+    parser.add_argument('--progress', type=float, help='Prints the progress of the run to stderr every given number of seconds')
+    parser.add_argument('--spill-dir', help='Builds the tree out of core, spilling its levels to files in the given directory, and writes it to the snapshot path, which is required')
+    parser.add_argument('--verify-sample', type=float, default=0.0, help='Fraction of the proofs, between 0 and 1, that are verified after checking the nodes of the tree')
 
     args = parser.parse_args()
+    if args.spill_dir is not None and args.snapshot is None:
+        parser.error("--spill-dir requires --snapshot")
+    if args.spill_dir is not None and args.workers > 1:
+        parser.error("--spill-dir builds the tree in a single process, it can't be used with --workers")
     
-    return args.input, args.output, args.audit_id
-
-def decode_user_balance(user_balance: tuple[str, str]) -> Leaf:
-    balance_str: str = user_balance[1]
-    new_balance_list: list[tuple[str, str]] = []
+    return args.input, args.input_format, args.output, args.audit_id, args.workers, args.shards, args.snapshot, args.spill_dir, args.verify_sample, args.metrics, args.progress, args.proof_format
 
-    balance_list_splitted = balance_str.split('|')
-    for balance in balance_list_splitted:
-        splitted_balance = balance.split(':')
-        if float(splitted_balance[1]) < 0: raise Exception("User balance must be positive")
+if __name__ == '__main__':
+    input_path, input_format, output_paths, audit_id, workers, shards, snapshot_path, spill_directory, sample_rate, metrics_path, progress_interval, proof_format = parse_arguments()
 
-        new_balance_list.append((splitted_balance[0], splitted_balance[1]))
+    metrics = None
+    if metrics_path is not None or progress_interval is not None:
+        metrics = Metrics(print_progress if progress_interval is not None else None, progress_interval or 0)
 
-    filtered_balance_list = list(filter(lambda balance: not float(balance[1]) == 0, new_balance_list))
-    return Leaf(user_balance[0], { balance[0]: balance[1] for balance in filtered_balance_list })
+    # The out of core build keeps the ids in a file as well, they are read back by position while writing the proofs
+    user_ids = [] if spill_directory is None else SpilledIds(spill_directory)
+    batches = iterate(metrics, 'parse', read_input(input_path, input_format, user_ids), size = lambda batch: len(batch.ids))
 
-if __name__ == '__main__':
-    input_path, output_paths, audit_id = parse_arguments()
+    if spill_directory is not None:
+        build_snapshot(batches, snapshot_path, hash_type = 'sha256', salt = audit_id.strip(), shuffle = True, directory = spill_directory, metrics = metrics)
+        mst = MerkleSumTree.load(snapshot_path)
+    else:
+        mst = MerkleSumTree(batches, hash_type = 'sha256', salt = audit_id.strip(), shuffle = True, workers = workers, metrics = metrics)
 
-    with open(input_path, 'r+') as file:
-        reader = csv.DictReader(file)
+    with phase(metrics, 'verify'):
+        verify_tree(mst, user_ids, sample_rate)
 
-        encoded_user_balances: list[tuple[str, str]] = [(row['id'].strip(), row['balances'].strip()) for row in reader]
-        user_balances: list[Leaf] = list(map(lambda user_balance: decode_user_balance(user_balance), encoded_user_balances))
+    if snapshot_path is not None and spill_directory is None:
+        with phase(metrics, 'save_snapshot'):
+            mst.save(snapshot_path)
 
-        mst = MerkleSumTree(user_balances, hash_type = 'sha256', salt = audit_id.strip(), shuffle = True)
+    with open(output_paths[0], 'w', newline='', encoding='utf-8') as write_file:
+        writer = csv.writer(write_file)
+        nodes = mst.get_nodes()
 
-        proofs = get_merkle_proofs(mst, list(map(lambda ub: ub.id, user_balances)))
+        for chunk in iterate(metrics, 'load_nodes', chunked(nodes), total = len(nodes), size = len):
+            with phase(metrics, 'write_tree'):
+                writer.writerows(node.to_string().split(',') for node in chunk)
 
-        verify_merkle_proofs(
-            user_balances,
-            proofs,
-            mst.get_root(), 
-            audit_id.strip()
-        )
-    
-        with open(output_paths[0], 'w', newline='', encoding='utf-8') as write_file:
-            writer = csv.writer(write_file)
-            nodes = mst.get_nodes()
+    format_proof = get_proof_formatter(mst, proof_format)
+    chunks = iterate(metrics, 'generate_proofs', chunked(get_merkle_proofs(mst, user_ids)), total = len(user_ids), size = len)
 
-            for node in nodes:
-                writer.writerow(node.to_string().split(','))
+    if shards is None and proof_format == 'binary':
+        with open(output_paths[1], 'wb') as write_file:
+            write_file.write(PROOFS_FILE_MAGIC)
 
+            for chunk in chunks:
+                with phase(metrics, 'write_proofs'):
+                    write_file.write(b''.join([encode_proof_record(id, format_proof(proof)) for id, proof in chunk]))
+    elif shards is None:
         with open(output_paths[1], 'w', newline='', encoding='utf-8') as write_file:
             writer = csv.writer(write_file)
 
-            for proof in proofs.items():
-                proof_map = map(lambda step: f"{{{step.to_string()}}}", proof[1])
-                merkle_proof = f"[{','.join(proof_map)}]"
-
-                writer.writerow([proof[0], merkle_proof])
-                
\ No newline at end of file
+            for chunk in chunks:
+                with phase(metrics, 'write_proofs'):
+                    writer.writerows([id, format_proof(proof)] for id, proof in chunk)
+    else:
+        with ShardedProofWriter(output_paths[1], shards, len(user_ids), proof_format) as writer:
+            for chunk in chunks:
+                with phase(metrics, 'write_proofs'):
+                    for id, proof in chunk:
+                        writer.write(mst.get_leaf_hash(id), id, format_proof(proof))
+
+    if metrics_path is not None:
+        metrics.write(metrics_path)
@@ -0,0 +1,48 @@
+from lib.merkle import MerkleSumTree
+from lib.proof_server import ProofRenderer, serve
+import argparse
+import asyncio
+import multiprocessing
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--snapshot', help='Path to a snapshot of the tree written by main.py --snapshot', required = True)
+    parser.add_argument('--host', default='127.0.0.1', help='Address the service listens on')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port the service listens on')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes serving requests on the same port')
+    parser.add_argument('--pinned-levels', type=int, default=16, help='Number of top levels of the tree whose proof steps are rendered on start, as long as they fit in --cache-bytes')
+    parser.add_argument('--cache-bytes', type=int, default=2 ** 26, help='Total size in bytes of the pinned proof steps and the rendered proofs kept in the cache of each process')
+
+    args = parser.parse_args()
+
+    return args.snapshot, args.host, args.port, args.workers, args.pinned_levels, args.cache_bytes
+
+def run_worker(snapshot_path: str, host: str, port: int, pinned_levels: int, cache_bytes: int, reuse_port: bool):
+    renderer = ProofRenderer(MerkleSumTree.load(snapshot_path), pinned_levels, cache_bytes)
+
+    try:
+        asyncio.run(serve(renderer, host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    snapshot_path, host, port, workers, pinned_levels, cache_bytes = parse_arguments()
+    print(f"Serving proofs of {snapshot_path} on http://{host}:{port} with {workers} processes")
+
+    if workers == 1:
+        run_worker(snapshot_path, host, port, pinned_levels, cache_bytes, False)
+    else:
+        # The snapshot is memory mapped, so the processes share the pages of the tree
+        processes = [
+            multiprocessing.Process(target = run_worker, args = (snapshot_path, host, port, pinned_levels, cache_bytes, True))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
@@ -0,0 +1,66 @@
+import unittest
+from decimal import Decimal
+from lib.balance import parse_units, format_units, format_balance, combine_units, decode_balance_units, decode_balance_columns, MAX_UNITS
+from lib.merkle import to_string, to_decimal_balance, combine_balances
+
+AMOUNTS = [
+    '0', '0.00000000', '0.00000001', '0.00000012', '0.00000099', '0.00000100', '0.12312030', '1', '1.',
+    '.5', '19.10069634', '69800.89997041', '0.000000005', '0.000000015', '0.0000000150001', '2.999999995',
+    '123456789012345678.12345678', '+3.1', '1E-8', '1.5e3'
+]
+
+class BalanceTest(unittest.TestCase):
+    def test_parse_units_rounds_as_decimal(self):
+        for amount in AMOUNTS:
+            self.assertEqual(parse_units(amount), int(round(Decimal(amount), 8).scaleb(8)), amount)
+
+    def test_parse_negative_units(self):
+        self.assertEqual(parse_units('-0.5'), -50000000)
+
+    def test_format_units_as_decimal(self):
+        for units in list(range(0, 2000)) + [10 ** 8 - 1, 10 ** 8, 10 ** 8 + 1, 10 ** 20 + 7]:
+            self.assertEqual(format_units(units), str(Decimal(units).scaleb(-8)))
+
+    def test_format_balance_as_to_string(self):
+        balances = dict({'ETH': '0.00000000', 'BTC': '0.00000012', 'ADA': '33.55713700'})
+        self.assertEqual(format_balance({ k: parse_units(v) for k, v in balances.items() }), to_string(to_decimal_balance(balances)))
+
+    def test_combine_units_as_combine_balances(self):
+        left = dict({'BTC': '0.00000012', 'ETH': '0.00000000'})
+        right = dict({'ADA': '33.55713700', 'BTC': '19.10069634'})
+
+        combined = combine_units({ k: parse_units(v) for k, v in left.items() }, { k: parse_units(v) for k, v in right.items() })
+
+        self.assertEqual(format_balance(combined), to_string(combine_balances(to_decimal_balance(left), to_decimal_balance(right))))
+
+    def test_decode_balance_units(self):
+        self.assertEqual(decode_balance_units(''), dict())
+        self.assertEqual(
+            decode_balance_units('ADA:0.00000000|BTC:0.00010052|ETH:0E-8|LUNA:0.000000001|UNI:16.05900000'),
+            dict({'BTC': 10052, 'LUNA': 0, 'UNI': 1605900000})
+        )
+
+        with self.assertRaises(Exception):
+            decode_balance_units('BTC:-0.000000001')
+
+    def test_decode_amounts_that_underflow_as_floats(self):
+        self.assertEqual(decode_balance_units('BTC:2e-492|ETH:9e-0644|ADA:-1e-400|UNI:1e-300'), dict({'UNI': 0}))
+        self.assertEqual(decode_balance_columns(['BTC:2e-492|UNI:1e-300']), dict({'UNI': [0]}))
+
+    def test_decode_balance_columns(self):
+        columns = decode_balance_columns(['BTC:0.00010052|ETH:0.00000000', '', 'ETH:1.5'])
+
+        self.assertEqual(columns, dict({'BTC': [10052, None, None], 'ETH': [None, None, 150000000]}))
+
+    def test_overflow(self):
+        with self.assertRaises(Exception):
+            parse_units('1' * 21)
+
+        with self.assertRaises(Exception):
+            decode_balance_columns(['SHIB:' + '1' * 21 + '.00000000'])
+
+        with self.assertRaises(Exception):
+            combine_units(dict({'SHIB': MAX_UNITS}), dict({'SHIB': 1}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import io
+import unittest
+from bench.generate import generate_users, write_users
+from main import read_user_balances
+
+class GenerateUsersTest(unittest.TestCase):
+    def test_same_seed_same_users(self):
+        # When
+        users = list(generate_users(20, 40, 0.5, 3, 7))
+
+        # Then
+        self.assertEqual(users, list(generate_users(20, 40, 0.5, 3, 7)))
+        self.assertNotEqual(users, list(generate_users(20, 40, 0.5, 3, 8)))
+        self.assertEqual(len(users[0][1].split('|')), 40)
+
+    def test_users_are_read_by_main(self):
+        # Given
+        file = io.StringIO()
+        write_users(file, generate_users(5, 3, 0.0, 2, 1))
+        file.seek(0)
+
+        # When
+        user_ids = []
+        batches = list(read_user_balances(file, user_ids))
+
+        # Then
+        self.assertEqual(len(user_ids), 5)
+        self.assertEqual(sorted(batches[0].balances), ['AAVE', 'ADA', 'ALGO'])
+        self.assertTrue(all(amount % 10 ** 6 == 0 for amount in batches[0].balances['ADA']))
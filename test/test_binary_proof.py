@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from decimal import Decimal
+from lib.merkle import MerkleSumTree, Leaf, Side, ProofStep, proof_to_string, encode_proof, decode_proof
+from lib.binary_proof import CurrencyDictionary, encode_varint, decode_varint, encode_proof_record, iter_proofs_file, PROOFS_FILE_MAGIC
+from lib.verification import ProofVerifier
+
+class BinaryProofTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'{i}.5', 'ETH': '0.00000000', 'SHIB': '0.00000001'})) for i in range(11)]
+        self.tree = MerkleSumTree(self.leaves, salt = 'audit')
+        self.root = self.tree.get_root()
+        self.dictionary = CurrencyDictionary(self.root.balances)
+
+    def test_varint(self):
+        # Given
+        values = [0, 1, 127, 128, 300, 10 ** 28 - 1]
+
+        # When
+        encoded = b''.join([encode_varint(value) for value in values])
+
+        # Then
+        offset = 0
+        for value in values:
+            decoded, offset = decode_varint(encoded, offset)
+            self.assertEqual(decoded, value)
+        self.assertEqual(len(encode_varint(127)), 1)
+
+    def test_round_trip(self):
+        # Given
+        proofs = [proof for _, proof in self.tree.iter_proofs()]
+
+        # When
+        decoded = [decode_proof(encode_proof(proof, self.dictionary), self.dictionary) for proof in proofs]
+
+        # Then
+        self.assertEqual([proof_to_string(proof) for proof in decoded], [proof_to_string(proof) for proof in proofs])
+
+    def test_proofs_file(self):
+        # Given
+        proofs = [(self.leaves[position].id, encode_proof(proof, self.dictionary)) for position, proof in self.tree.iter_proofs()]
+
+        with tempfile.TemporaryFile() as file:
+            file.write(PROOFS_FILE_MAGIC + b''.join([encode_proof_record(id, proof) for id, proof in proofs]))
+            file.seek(0)
+
+            # When
+            read = list(iter_proofs_file(file))
+
+        # Then
+        self.assertEqual(read, proofs)
+
+    def test_unknown_currency(self):
+        # Given
+        step = ProofStep(Side.LEFT, b'\x00' * 32, dict({'ADA': Decimal('1.00000000')}))
+
+        # When / Then
+        with self.assertRaises(Exception):
+            encode_proof([step], self.dictionary)
+
+    def test_verify_binary_proofs(self):
+        # Given
+        verifier = ProofVerifier(self.root.hash, self.tree.tree.get_balances(1), dictionary = self.dictionary)
+        proofs = { self.leaves[position].id: encode_proof(proof, self.dictionary) for position, proof in self.tree.iter_proofs() }
+
+        def verify(id: str, proof: bytes):
+            leaf_hash = self.tree.get_leaf_hash(id)
+            verifier.verify_binary(leaf_hash, self.tree.tree.get_balances(self.tree.leaves_map[leaf_hash]), proof)
+
+        # When / Then
+        for leaf in self.leaves:
+            verify(leaf.id, proofs[leaf.id])
+
+        # Swapping the side of the last step
+        tampered = bytearray(proofs['user-3'])
+        tampered[3] ^= 1 << (self.tree.tree.height - 1)
+        with self.assertRaises(Exception):
+            verify('user-3', bytes(tampered))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import os
+import tempfile
+import unittest
+from lib.merkle import MerkleSumTree
+from lib.columnar import read_columnar_balances, pyarrow
+from main import read_user_balances
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class ColumnarInputTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.csv = (
+            'id,balances\n'
+            ' user-1 ,BTC:1.00000001|ETH:0.5\n'
+            'user-2,ETH:0\n'
+            'user-3,BTC:0.00000001|SHIB:10000000000\n'
+        )
+        self.table = pyarrow.table({
+            'id': [' user-1 ', 'user-2', 'user-3'],
+            'BTC': pyarrow.array([100000001, None, 1], pyarrow.int64()),
+            'ETH': pyarrow.array([50000000, 0, None], pyarrow.int64()),
+            'SHIB': pyarrow.array([None, None, 10 ** 18], pyarrow.uint64()),
+            'USDT': pyarrow.array([None, None, None], pyarrow.int64())
+        })
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, table, input_format: str) -> str:
+        path = os.path.join(self.directory.name, f'users.{input_format}')
+        if input_format == 'parquet':
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with pyarrow.ipc.new_file(path, table.schema) as writer:
+                writer.write_table(table, max_chunksize = 2)
+
+        return path
+
+    def test_same_tree_as_csv(self):
+        # Given
+        csv_tree = MerkleSumTree(read_user_balances(io.StringIO(self.csv), []), salt = 'audit', shuffle = False)
+
+        for input_format in ['arrow', 'parquet']:
+            # When
+            user_ids = []
+            tree = MerkleSumTree(read_columnar_balances(self.write(self.table, input_format), input_format, user_ids, 2), salt = 'audit', shuffle = False)
+
+            # Then
+            self.assertEqual(user_ids, ['user-1', 'user-2', 'user-3'])
+            self.assertEqual(tree.get_root().to_string(), csv_tree.get_root().to_string())
+            self.assertEqual([node.to_string() for node in tree.get_nodes()], [node.to_string() for node in csv_tree.get_nodes()])
+
+    def test_negative_balance(self):
+        # Given
+        table = self.table.set_column(1, 'BTC', pyarrow.array([1, -1, None], pyarrow.int64()))
+
+        # When / Then
+        with self.assertRaises(Exception):
+            list(read_columnar_balances(self.write(table, 'arrow'), 'arrow', []))
+
+    def test_non_integer_column(self):
+        # Given
+        table = self.table.set_column(1, 'BTC', pyarrow.array(['1', None, None]))
+
+        # When / Then
+        with self.assertRaises(Exception):
+            list(read_columnar_balances(self.write(table, 'parquet'), 'parquet', []))
+
+if __name__ == '__main__':
+    unittest.main()
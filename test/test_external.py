@@ -0,0 +1,112 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+from lib.merkle import MerkleSumTree, Leaf, LeafBatch
+from lib.external import build_snapshot, SpilledIds
+
+class ExternalBuildTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'{i}.00000001', 'ETH': '0' if i % 3 else '2'})) for i in range(13)]
+        self.leaves.append(Leaf('whale', dict({'SHIB': '99999999999999999999'})))
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tree.bin')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def build(self, leaves, seed: int = 0):
+        random.seed(seed)
+        build_snapshot(iter(leaves), self.path, salt = 'audit', directory = self.directory.name)
+
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def save(self, leaves, seed: int = 0):
+        random.seed(seed)
+        MerkleSumTree(leaves, salt = 'audit').save(self.path)
+
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def test_same_snapshot_as_in_memory_build(self):
+        # Given
+        batch = LeafBatch(['a', 'b', 'c'], dict({'BTC': [1, None, 3], 'ETH': [None, 5, None]}))
+
+        for leaves in [self.leaves, self.leaves[:1], [], [batch]]:
+            for seed in range(3):
+                # When
+                snapshot = self.build(leaves, seed)
+
+                # Then
+                self.assertEqual(snapshot, self.save(leaves, seed))
+
+    def test_spilled_runs_and_columns(self):
+        # Given
+        expected = self.save(self.leaves)
+
+        # When
+        with mock.patch('lib.external.RUN_SIZE', 3), mock.patch('lib.external.COLUMN_CHUNK_SIZE', 2):
+            snapshot = self.build(self.leaves)
+
+        # Then
+        self.assertEqual(snapshot, expected)
+
+    def test_proofs_of_loaded_tree(self):
+        # Given
+        random.seed(0)
+        tree = MerkleSumTree(self.leaves, salt = 'audit')
+        self.build(self.leaves)
+
+        # When
+        loaded = MerkleSumTree.load(self.path)
+        loaded.verify_nodes()
+
+        # Then
+        for leaf in self.leaves:
+            self.assertEqual(
+                [step.to_string() for step in loaded.get_proof(leaf.id)],
+                [step.to_string() for step in tree.get_proof(leaf.id)]
+            )
+
+    def test_duplicate_leaf(self):
+        # When / Then
+        with self.assertRaises(Exception):
+            self.build(self.leaves + [Leaf('user-1', dict())])
+
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_negative_balance(self):
+        # When / Then
+        with self.assertRaises(Exception):
+            self.build([Leaf('user', dict({'BTC': '-1'}))])
+
+class SpilledIdsTest(unittest.TestCase):
+    def test_ids_read_by_position(self):
+        # Given
+        ids = SpilledIds()
+        expected = ['a', '', 'ünïcode', 'user-3']
+
+        # When
+        ids.extend(expected[:2])
+        ids.extend(expected[2:])
+
+        # Then
+        self.assertEqual(len(ids), 4)
+        self.assertEqual([ids[position] for position in [3, 0, 2, 1]], ['user-3', 'a', 'ünïcode', ''])
+        self.assertEqual(list(ids), expected)
+        self.assertRaises(IndexError, lambda: ids[4])
+        self.assertRaises(Exception, lambda: ids.extend(['late']))
+        ids.close()
+
+    def test_no_ids(self):
+        # Given
+        ids = SpilledIds()
+
+        # When / Then
+        self.assertEqual(list(ids), [])
+        ids.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 import unittest
-from lib.merkle import MerkleSumTree, Leaf, Node, to_string, combine_balances, to_decimal_balance, Side, verify_merkle_proof, ProofStep
+from lib.merkle import MerkleSumTree, Leaf, LeafBatch, Node, to_string, combine_balances, to_decimal_balance, Side, verify_merkle_proof, verify_merkle_proof_from_leaf, ProofStep
 import hashlib
 from decimal import Decimal
 
@@ -63,6 +63,30 @@ class MerkleSumTreeTest(unittest.TestCase):
         self.assertEqual(root.hash, expected_root_hash)
         self.assertEqual(root.balances, expected_root_balances)
 
+    def test_tree_from_leaves_iterator(self):
+        # When
+        tree = MerkleSumTree(leaves = iter(INIT_LEAVES), salt = INIT_AUDIT_ID, shuffle = False)
+
+        # Then
+        self.assertEqual([node.to_string() for node in tree.get_nodes()], [node.to_string() for node in self.tree.get_nodes()])
+
+    def test_tree_from_leaf_batches(self):
+        # Given
+        batches = [
+            LeafBatch([leaf.id for leaf in INIT_LEAVES[:3]], dict({'BTC': [1, 2, 112000001], 'ETH': [12312030, 0, 10123123]})),
+            LeafBatch([INIT_LEAVES[3].id], dict({'BTC': [100010], 'ETH': [512339900]}))
+        ]
+
+        # When
+        tree = MerkleSumTree(leaves = batches, salt = INIT_AUDIT_ID, shuffle = False)
+
+        # Then
+        self.assertEqual([node.to_string() for node in tree.get_nodes()], [node.to_string() for node in self.tree.get_nodes()])
+
+    def test_duplicate_leaf_is_rejected(self):
+        with self.assertRaises(Exception):
+            MerkleSumTree(leaves = INIT_LEAVES + [INIT_LEAVES[0]], salt = INIT_AUDIT_ID, shuffle = False)
+
     def test_get_proof_correctly(self):
         # Given
         leaf = INIT_LEAVES[0]
@@ -81,6 +105,141 @@ class MerkleSumTreeTest(unittest.TestCase):
         self.assertEqual(proof[1].hash.hex(), 'e73ef74ee86648217d17b8c852e9532a2cea9997dcc0dcfef2812925ffdf9d9d')
         self.assertEqual(proof[1].balances, dict({'BTC': Decimal('1.12100011'), 'ETH': Decimal('5.22463023')}))
 
+class IterProofsTest(unittest.TestCase):
+    def test_iter_proofs_equals_get_proof(self):
+        # Given
+        leaves = [Leaf(f'user-{i}', dict({'BTC': f'0.0000{i:04d}'})) for i in range(11)]
+        tree = MerkleSumTree(leaves = leaves, salt = INIT_AUDIT_ID, shuffle = True)
+
+        # When
+        proofs = list(tree.iter_proofs())
+
+        # Then
+        self.assertEqual(sorted(position for position, _ in proofs), list(range(len(leaves))))
+        for position, proof in proofs:
+            expected_proof = tree.get_proof(leaves[position].id)
+            self.assertEqual([step.to_string() for step in proof], [step.to_string() for step in expected_proof])
+
+class UpdateMerkleSumTreeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'0.0000{i:04d}', 'ETH': f'{i}.10000000'})) for i in range(11)]
+        self.tree = MerkleSumTree(leaves = self.leaves, salt = INIT_AUDIT_ID, shuffle = False)
+
+    def assertSameNodes(self, tree: MerkleSumTree, expected_tree: MerkleSumTree):
+        self.assertEqual([node.to_string() for node in tree.get_nodes()], [node.to_string() for node in expected_tree.get_nodes()])
+
+    def test_update_leaves(self):
+        # Given
+        leaves = self.leaves[:3] + [Leaf('user-3', dict({'SHIB': '12.5'}))] + self.leaves[4:]
+
+        # When
+        update = self.tree.update_leaves(dict({'user-3': dict({'SHIB': '12.5'})}))
+
+        # Then
+        self.assertSameNodes(self.tree, MerkleSumTree(leaves = leaves, salt = INIT_AUDIT_ID, shuffle = False))
+        self.assertEqual(update.dirty_nodes, set([19, 9, 4, 2, 1]))
+
+    def test_stale_proofs(self):
+        # When
+        update = self.tree.update_leaves(dict({'user-3': dict({'SHIB': '12.5'})}))
+
+        # Then
+        stale_positions = [position for position, _ in self.tree.iter_proofs(update)]
+        self.assertEqual(stale_positions, [i for i in range(11) if i != 3])
+
+    def test_insert_leaves(self):
+        # Given
+        leaf = Leaf('user-11', dict({'ADA': '3'}))
+
+        # When
+        update = self.tree.insert_leaves([leaf])
+
+        # Then
+        self.assertSameNodes(self.tree, MerkleSumTree(leaves = self.leaves + [leaf], salt = INIT_AUDIT_ID, shuffle = False))
+        self.assertEqual(update.new_leaves, set([27]))
+        self.assertEqual(self.tree.leaf_positions[11], 11)
+
+    def test_insert_duplicate_leaf(self):
+        # When / Then
+        with self.assertRaises(Exception):
+            self.tree.insert_leaves([Leaf('user-1', dict({'ADA': '3'}))])
+
+    def test_remove_leaves(self):
+        # When
+        self.tree.remove_leaves(['user-10'])
+
+        # Then
+        self.assertSameNodes(self.tree, MerkleSumTree(leaves = self.leaves[:10], salt = INIT_AUDIT_ID, shuffle = False))
+        with self.assertRaises(KeyError):
+            self.tree.get_proof('user-10')
+
+class VerifyNodesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'0.0000{i:04d}', 'ETH': f'{i}.10000000'})) for i in range(11)]
+        self.tree = MerkleSumTree(leaves = self.leaves, salt = INIT_AUDIT_ID)
+
+    def test_verify_nodes(self):
+        # When
+        self.tree.update_leaves(dict({'user-3': dict({'SHIB': '12.5'})}))
+        self.tree.remove_leaves(['user-5'])
+
+        # Then
+        self.tree.verify_nodes()
+
+    def test_tampered_hash(self):
+        # Given
+        self.tree.tree.levels[1].set_hash(5, b'\x01' * 32)
+
+        # When / Then
+        with self.assertRaises(Exception):
+            self.tree.verify_nodes()
+
+    def test_tampered_balances(self):
+        # Given
+        self.tree.tree.levels[0].set_balances(10, dict({'BTC': 10 ** 9}))
+
+        # When / Then
+        with self.assertRaises(Exception):
+            self.tree.verify_nodes()
+
+class ParallelMerkleSumTreeTest(unittest.TestCase):
+    def test_parallel_tree_equals_serial_tree(self):
+        # Given
+        leaves = [Leaf(f'user-{i}', dict({'BTC': f'0.0000{i:04d}', 'ETH': f'{i}.10000000'})) for i in range(11)]
+
+        # When
+        serial_tree = MerkleSumTree(leaves = leaves, salt = INIT_AUDIT_ID, shuffle = False)
+        parallel_trees = [MerkleSumTree(leaves = leaves, salt = INIT_AUDIT_ID, shuffle = False, workers = workers) for workers in [2, 3, 4, 32]]
+
+        # Then
+        for parallel_tree in parallel_trees:
+            self.assertEqual([node.to_string() for node in parallel_tree.get_nodes()], [node.to_string() for node in serial_tree.get_nodes()])
+            self.assertEqual(parallel_tree.leaves_map, serial_tree.leaves_map)
+
+    def test_parallel_tree_from_leaf_batches(self):
+        # Given
+        ids = [f'user-{i}' for i in range(11)]
+        batches = [LeafBatch(ids[:6], dict({'BTC': [i if i % 3 else None for i in range(6)]})), Leaf(ids[6], dict({'ETH': '1'}))]
+        batches.append(LeafBatch(ids[7:], dict({'BTC': [10 ** 20, None, 7, 8], 'ETH': [None, 1, None, 2]})))
+
+        # When
+        serial_tree = MerkleSumTree(leaves = batches, salt = INIT_AUDIT_ID, shuffle = False)
+        parallel_tree = MerkleSumTree(leaves = batches, salt = INIT_AUDIT_ID, shuffle = False, workers = 2)
+
+        # Then
+        self.assertEqual([node.to_string() for node in parallel_tree.get_nodes()], [node.to_string() for node in serial_tree.get_nodes()])
+
+    def test_invalid_leaf_batches_are_rejected(self):
+        for workers in [1, 2]:
+            for batches in [
+                [LeafBatch(['a', 'b'], dict({'BTC': [1, -1]}))],
+                [LeafBatch(['a', 'b'], dict({'BTC': [1, -5]}))],
+                [LeafBatch(['a', 'a'], dict())],
+                [LeafBatch(['a'], dict()), LeafBatch(['b', 'a'], dict())]
+            ]:
+                with self.assertRaises(Exception):
+                    MerkleSumTree(leaves = batches, salt = INIT_AUDIT_ID, workers = workers)
+
 class VerifyMerkleProof(unittest.TestCase):
     def setUp(self) -> None:
         # Use root from above test case
@@ -108,5 +267,17 @@ class VerifyMerkleProof(unittest.TestCase):
         # Then
         # No assertion should be raised
 
+    def test_verify_proof_steps_hook(self):
+        # Given
+        steps = []
+        leaf = Node(hashlib.sha256(str.encode(INIT_AUDIT_ID + INIT_LEAVES[0].id)).digest(), to_decimal_balance(INIT_LEAVES[0].balances))
+
+        # When
+        verify_merkle_proof_from_leaf(self.root, self.proof_steps, leaf, on_step = lambda step, node: steps.append((step, node.hash)))
+
+        # Then
+        self.assertEqual([step for step, _ in steps], [1, 2])
+        self.assertEqual(steps[-1][1], self.root.hash)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
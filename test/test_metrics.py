@@ -0,0 +1,44 @@
+import unittest
+from lib.merkle import MerkleSumTree, Leaf
+from lib.metrics import Metrics, iterate
+
+class MetricsTest(unittest.TestCase):
+    def test_phases_add_up(self):
+        # Given
+        metrics = Metrics()
+
+        # When
+        for _ in range(3):
+            with metrics.phase('write'):
+                pass
+
+        # Then
+        self.assertEqual(metrics.phases['write']['calls'], 3)
+        self.assertGreaterEqual(metrics.phases['write']['wall'], 0)
+
+    def test_iterate_reports_progress(self):
+        # Given
+        progress = []
+        metrics = Metrics(lambda phase, done, total: progress.append((phase, done, total)), progress_interval = 0)
+
+        # When
+        items = list(iterate(metrics, 'parse', [[1, 2], [3]], total = 3, size = len))
+
+        # Then
+        self.assertEqual(items, [[1, 2], [3]])
+        self.assertEqual(progress, [('parse', 2, 3), ('parse', 3, 3)])
+
+    def test_tree_metrics(self):
+        # Given
+        metrics = Metrics()
+        leaves = [Leaf(f'user-{i}', dict({'BTC': f'0.0000000{i}'})) for i in range(3)]
+
+        # When
+        MerkleSumTree(leaves, salt = 'audit', metrics = metrics)
+
+        # Then
+        self.assertEqual(metrics.values['nodes_per_level'], [3, 2, 1])
+        # 3 leaves, the 2 empty nodes above an empty leaf and 3 internal nodes
+        self.assertEqual(metrics.counters['hashes'], 8)
+        self.assertIn('hash_leaves', metrics.phases)
+        self.assertIn('build', metrics.phases)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from lib.merkle import MerkleSumTree, Leaf, proof_to_string, encode_proof, decode_proof
+from lib.binary_proof import CurrencyDictionary
+from lib.proof_index import ShardedProofWriter, ProofIndex, shard_file_name
+
+class ProofIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.audit_id = 'audit'
+        self.ids = [f'user-{i}' for i in range(10)]
+        self.tree = MerkleSumTree([Leaf(id, dict({'BTC': f'{i}.5'})) for i, id in enumerate(self.ids)], salt = self.audit_id)
+        self.directory = tempfile.TemporaryDirectory()
+
+        with ShardedProofWriter(self.directory.name, 3, len(self.ids)) as writer:
+            for id in self.ids:
+                writer.write(self.tree.get_leaf_hash(id), id, proof_to_string(self.tree.get_proof(id)))
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_find_proofs(self):
+        # Given
+        index = ProofIndex(self.directory.name)
+
+        # When
+        proofs = { id: index.find(id, self.audit_id) for id in self.ids }
+        index.close()
+
+        # Then
+        for id in self.ids:
+            self.assertEqual(proofs[id], proof_to_string(self.tree.get_proof(id)))
+
+    def test_proofs_are_sharded(self):
+        # Given
+        shard_sizes = [os.path.getsize(os.path.join(self.directory.name, shard_file_name(shard))) for shard in range(3)]
+
+        # Then
+        self.assertGreater(sum(1 for size in shard_sizes if size > 0), 1)
+
+    def test_missing_proof(self):
+        # Given
+        with ProofIndex(self.directory.name) as index:
+            # When
+            proof = index.find('user-10', self.audit_id)
+            other_audit_proof = index.find('user-1', 'other')
+
+        # Then
+        self.assertIsNone(proof)
+        self.assertIsNone(other_audit_proof)
+
+    def test_find_binary_proofs(self):
+        # Given
+        dictionary = CurrencyDictionary(['BTC'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            with ShardedProofWriter(directory, 2, len(self.ids), 'binary') as writer:
+                for id in self.ids:
+                    writer.write(self.tree.get_leaf_hash(id), id, encode_proof(self.tree.get_proof(id), dictionary))
+
+            # When
+            with ProofIndex(directory) as index:
+                proofs = { id: index.find(id, self.audit_id) for id in self.ids }
+
+            # Then
+            self.assertTrue(os.path.exists(os.path.join(directory, shard_file_name(0, 'binary'))))
+
+        for id in self.ids:
+            self.assertEqual(proof_to_string(decode_proof(proofs[id], dictionary)), proof_to_string(self.tree.get_proof(id)))
+
+    def test_duplicate_proof(self):
+        # Given
+        with tempfile.TemporaryDirectory() as directory:
+            with ShardedProofWriter(directory, 1, 2) as writer:
+                writer.write(self.tree.get_leaf_hash('user-1'), 'user-1', '[]')
+
+                # When / Then
+                with self.assertRaises(Exception):
+                    writer.write(self.tree.get_leaf_hash('user-1'), 'user-1', '[]')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import base64
+import json
+import unittest
+from lib.merkle import MerkleSumTree, Leaf, proof_to_string, encode_proof
+from lib.proof_server import ProofRenderer, handle_connection
+
+class ProofServerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user {i}', dict({'BTC': f'{i}.5'})) for i in range(11)]
+        self.tree = MerkleSumTree(self.leaves, salt = 'audit')
+        self.renderer = ProofRenderer(self.tree, pinned_levels = 2, cache_bytes = 4096)
+
+    async def request(self, *targets: str) -> list[tuple[int, dict]]:
+        server = await asyncio.start_server(lambda reader, writer: handle_connection(self.renderer, reader, writer), '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+
+        responses = []
+        for target in targets:
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('latin-1'))
+            lines = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+            length = next(int(line.split(':', 1)[1]) for line in lines if line.startswith('Content-Length:'))
+            responses.append((int(lines[0].split(' ')[1]), json.loads(await reader.readexactly(length))))
+
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+        return responses
+
+    def test_proofs_equal_tree_proofs(self):
+        # When / Then
+        for leaf in self.leaves:
+            self.assertEqual(proof_to_string(self.renderer.get_proof(leaf.id)), proof_to_string(self.tree.get_proof(leaf.id)))
+            self.assertEqual(json.loads(self.renderer.render_proof(leaf.id))['proof'], proof_to_string(self.tree.get_proof(leaf.id)))
+            self.assertEqual(
+                base64.b64decode(json.loads(self.renderer.render_proof(leaf.id, 'binary'))['proof']),
+                encode_proof(self.tree.get_proof(leaf.id), self.renderer.dictionary)
+            )
+
+        self.assertIsNone(self.renderer.render_proof('unknown'))
+
+    def test_cache_is_bounded_by_bytes(self):
+        # Given
+        renderer = ProofRenderer(self.tree, pinned_levels = 2, cache_bytes = 1500)
+
+        # When
+        bodies = [renderer.render_proof(leaf.id) for leaf in self.leaves]
+
+        # Then
+        cached_bodies = bodies[len(bodies) - len(renderer._recent):]
+        self.assertGreater(renderer.pinned_bytes, 0)
+        self.assertLess(len(renderer._recent), len(self.leaves))
+        self.assertLessEqual(renderer.pinned_bytes + sum(len(body) for body in cached_bodies), 1500)
+        self.assertEqual(bodies, [renderer.render_proof(leaf.id) for leaf in self.leaves])
+
+    def test_pinned_levels_are_bounded_by_bytes(self):
+        # When
+        renderer = ProofRenderer(self.tree, pinned_levels = 4, cache_bytes = 100)
+
+        # Then
+        self.assertEqual(renderer.pinned_bytes, 0)
+        self.assertEqual(renderer.render_proof('user 3'), self.renderer.render_proof('user 3'))
+
+    async def test_requests(self):
+        # When
+        root, proof, missing = await self.request('/root', '/proof/user%203', '/proof/unknown')
+
+        # Then
+        self.assertEqual(root, (200, dict({
+            'root_hash': self.tree.get_root().hash.hex(),
+            'root_balances': self.tree.get_root().encode_balances(),
+            'hash_algorithm': 'sha256'
+        })))
+        self.assertEqual(proof, (200, dict({ 'id': 'user 3', 'format': 'text', 'proof': proof_to_string(self.tree.get_proof('user 3')) })))
+        self.assertEqual(missing[0], 404)
+
+if __name__ == '__main__':
+    unittest.main()
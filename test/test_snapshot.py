@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from lib.merkle import MerkleSumTree, Leaf
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'{i}.00000001', 'ETH': '0.00000012'})) for i in range(13)]
+        self.leaves.append(Leaf('whale', dict({'SHIB': '99999999999999999999'})))
+        self.tree = MerkleSumTree(self.leaves, salt = 'audit')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tree.bin')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_load_saved_tree(self):
+        # Given
+        self.tree.save(self.path)
+
+        # When
+        loaded = MerkleSumTree.load(self.path)
+
+        # Then
+        self.assertEqual(loaded.salt, 'audit')
+        self.assertEqual(loaded.get_root().to_string(), self.tree.get_root().to_string())
+        self.assertEqual([node.to_string() for node in loaded.get_nodes()], [node.to_string() for node in self.tree.get_nodes()])
+
+        for leaf in self.leaves:
+            self.assertEqual(
+                [step.to_string() for step in loaded.get_proof(leaf.id)],
+                [step.to_string() for step in self.tree.get_proof(leaf.id)]
+            )
+
+    def test_iter_proofs_of_loaded_tree(self):
+        # Given
+        self.tree.save(self.path)
+        loaded = MerkleSumTree.load(self.path)
+
+        # When
+        proofs = [(position, [step.to_string() for step in proof]) for position, proof in loaded.iter_proofs()]
+
+        # Then
+        self.assertEqual(proofs, [(position, [step.to_string() for step in proof]) for position, proof in self.tree.iter_proofs()])
+
+    def test_positions_count_of_loaded_tree(self):
+        # Given
+        self.tree.remove_leaves(['whale'])
+        self.tree.save(self.path)
+
+        # When
+        loaded = MerkleSumTree.load(self.path)
+
+        # Then
+        self.assertEqual(loaded.positions_count, len(self.leaves))
+
+    def test_unknown_leaf(self):
+        # Given
+        self.tree.save(self.path)
+        loaded = MerkleSumTree.load(self.path)
+
+        # When / Then
+        with self.assertRaises(KeyError):
+            loaded.get_proof('unknown')
+
+    def test_truncated_snapshot(self):
+        # Given
+        self.tree.save(self.path)
+        with open(self.path, 'r+b') as file:
+            file.truncate(os.path.getsize(self.path) - 8)
+
+        # When / Then
+        with self.assertRaises(Exception):
+            MerkleSumTree.load(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
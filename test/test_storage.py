@@ -0,0 +1,105 @@
+import unittest
+from lib.storage import NodeStore, TreeStore, EncodingCache, LRUCache, ABSENT
+
+class NodeStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.store = NodeStore(4)
+
+    def test_absent_and_zero_balances(self):
+        # When
+        self.store.set_balances(1, dict({'BTC': 0, 'ETH': 5}))
+        self.store.set_balances(2, dict({'ETH': 7}))
+
+        # Then
+        self.assertEqual(self.store.get_balances(1), dict({'BTC': 0, 'ETH': 5}))
+        self.assertEqual(self.store.get_balances(2), dict({'ETH': 7}))
+        self.assertEqual(self.store.get_balances(3), dict())
+        self.assertEqual(self.store.columns['BTC'][2], ABSENT)
+
+    def test_amounts_above_64_bits(self):
+        # Given
+        amount = 2 ** 70
+
+        # When
+        self.store.set_balances(1, dict({'SHIB': 1}))
+        self.store.set_balances(2, dict({'SHIB': amount}))
+
+        # Then
+        self.assertEqual(self.store.get_balances(1), dict({'SHIB': 1}))
+        self.assertEqual(self.store.get_balances(2), dict({'SHIB': amount}))
+
+    def test_copy_from(self):
+        # Given
+        source = NodeStore(4)
+        source.set_hash(2, b'\x01' * 32)
+        source.set_balances(2, dict({'BTC': 3}))
+        source.set_balances(3, dict({'SHIB': 2 ** 70}))
+
+        # When
+        self.store.copy_from(source, 2, 0, 2)
+
+        # Then
+        self.assertEqual(self.store.get_hash(0), b'\x01' * 32)
+        self.assertEqual(self.store.get_balances(0), dict({'BTC': 3}))
+        self.assertEqual(self.store.get_balances(1), dict({'SHIB': 2 ** 70}))
+
+class TreeStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.empty_hashes = [bytes([level]) * 32 for level in range(4)]
+        self.store = TreeStore(3, 5, self.empty_hashes)
+
+    def test_empty_nodes_are_not_stored(self):
+        # Then
+        self.assertEqual([len(level) for level in self.store.levels], [5, 3, 2, 1])
+        self.assertTrue(self.store.is_stored(12))
+        self.assertFalse(self.store.is_stored(13))
+        self.assertEqual(self.store.get_hash(13), self.empty_hashes[0])
+        self.assertEqual(self.store.get_hash(7), self.empty_hashes[1])
+        self.assertEqual(self.store.get_balances(7), dict())
+
+    def test_resize(self):
+        # Given
+        self.store.set_hash(12, b'\x01' * 32)
+        self.store.set_balances(12, dict({'BTC': 3}))
+
+        # When
+        self.store.resize(4)
+        self.store.resize(6)
+
+        # Then
+        self.assertEqual([len(level) for level in self.store.levels], [6, 3, 2, 1])
+        self.assertEqual(self.store.get_hash(12), bytes(32))
+        self.assertEqual(self.store.get_balances(12), dict())
+
+class EncodingCacheTest(unittest.TestCase):
+    def test_only_pinned_nodes_are_kept(self):
+        # Given
+        cache = EncodingCache(pinned_levels = 2)
+
+        # When
+        cache.put(3, 'BTC:1.00000000')
+        cache.put(4, 'ETH:1E-8')
+
+        # Then
+        self.assertEqual(cache.get(3), 'BTC:1.00000000')
+        self.assertIsNone(cache.get(4))
+
+class LRUCacheTest(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        # Given
+        cache = LRUCache(max_bytes = 16)
+        cache.put(4, 'ETH:1E-8')
+        cache.put(5, 'ADA:1E-8')
+
+        # When
+        cache.get(4)
+        cache.put(6, 'BTC:1E-8')
+
+        # Then
+        self.assertEqual(cache.get(4), 'ETH:1E-8')
+        self.assertIsNone(cache.get(5))
+        self.assertEqual(cache.get(6), 'BTC:1E-8')
+        self.assertEqual(len(cache), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from lib.merkle import MerkleSumTree, Leaf
+from lib.tree_check import check_tree_file, get_leaves_count
+
+class TreeCheckTest(unittest.TestCase):
+    def setUp(self) -> None:
+        leaves = [Leaf(f'user-{i}', dict({'BTC': f'{i}.00000001', 'ETH': '0' if i % 3 else '0.00000012'})) for i in range(13)]
+        self.tree = MerkleSumTree(leaves, salt = 'audit')
+        self.root = self.tree.get_root()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tree.csv')
+        self.rows = [node.to_string().split(',') for node in self.tree.get_nodes()]
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write_rows(self, rows):
+        with open(self.path, 'w', newline='', encoding='utf-8') as file:
+            csv.writer(file).writerows(rows)
+
+    def check(self, workers: int = 1):
+        with mock.patch('lib.tree_check.CHECK_CHUNK_SIZE', 2), mock.patch('lib.tree_check.INDEX_INTERVAL', 3):
+            return check_tree_file(self.path, self.root.hash, self.root.encode_balances(), 'sha256', workers)
+
+    def test_valid_tree(self):
+        # Given
+        self.write_rows(self.rows)
+
+        # When / Then
+        self.assertIsNone(self.check())
+        self.assertIsNone(self.check(workers = 2))
+
+    def test_tampered_leaf(self):
+        # Given
+        leaf_index = self.tree.leaves_map[self.tree.get_leaf_hash('user-4')]
+        row = len(self.rows) - self.tree.tree.total_leaves - len(self.tree.leaf_positions) + leaf_index
+        self.rows[row][1] = self.rows[row][1].replace('BTC:4.', 'BTC:5.')
+        self.write_rows(self.rows)
+
+        # When
+        mismatch = self.check()
+
+        # Then
+        self.assertEqual(mismatch.index, leaf_index // 2)
+        self.assertEqual(mismatch.message, "Hash is not equal to the hash of its children")
+
+    def test_negative_leaf(self):
+        # Given
+        self.rows[-1][1] = 'BTC:-1.00000000'
+        self.write_rows(self.rows)
+
+        # When
+        mismatch = self.check()
+
+        # Then
+        self.assertEqual(mismatch.index, self.tree.tree.total_leaves + len(self.tree.leaf_positions) - 1)
+        self.assertEqual(mismatch.message, "At least one balance was negative")
+
+    def test_other_root(self):
+        # Given
+        self.write_rows(self.rows)
+
+        # When
+        mismatch = check_tree_file(self.path, self.root.hash, 'BTC:1.00000000')
+
+        # Then
+        self.assertEqual(mismatch.index, 1)
+
+    def test_missing_rows(self):
+        # Given
+        self.write_rows(self.rows[:-1])
+
+        # When / Then
+        with self.assertRaises(Exception):
+            self.check()
+
+    def test_truncated_tree_file(self):
+        # Given
+        self.write_rows(self.rows[:-1])
+        root_path = os.path.join(self.directory.name, 'root.json')
+        with open(root_path, 'w') as file:
+            json.dump({'root_hash': self.root.hash.hex(), 'root_balances': self.root.encode_balances(), 'hash_algorithm': 'sha256'}, file)
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'verify_tree.py')
+
+        # When
+        result = subprocess.run(
+            [sys.executable, script, '-i', self.path, '-r', root_path, '-w', '1'],
+            capture_output = True, text = True, cwd = os.path.dirname(script)
+        )
+
+        # Then
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("Malformed tree file: No tree has", result.stderr)
+        self.assertNotIn("Traceback", result.stderr)
+
+    def test_leaves_count(self):
+        for leaves_count in [0, 1, 2, 3, 13, 64, 1000]:
+            tree = MerkleSumTree([Leaf(f'user-{i}', dict()) for i in range(leaves_count)])
+
+            self.assertEqual(get_leaves_count(len(tree.get_nodes())), leaves_count)
+
+if __name__ == '__main__':
+    unittest.main()
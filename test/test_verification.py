@@ -0,0 +1,79 @@
+import contextlib
+import csv
+import io
+import unittest
+from lib.merkle import MerkleSumTree, Leaf, proof_to_string
+from lib.balance import decode_balance_units
+from lib.verification import ProofVerifier
+from verify import verify_bulk
+
+class ProofVerifierTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'{i}.5', 'ETH': '0.00000012'})) for i in range(11)]
+        self.tree = MerkleSumTree(self.leaves, salt = 'audit')
+        root = self.tree.get_root()
+        self.verifier = ProofVerifier(root.hash, decode_balance_units(root.encode_balances()), cache_size = 8)
+
+    def verify(self, leaf: Leaf, proof_str: str) -> None:
+        self.verifier.verify(self.tree.get_leaf_hash(leaf.id), decode_balance_units(f"BTC:{leaf.balances['BTC']}|ETH:0.00000012"), proof_str)
+
+    def test_verify_all_proofs(self):
+        # Given
+        proofs = { self.leaves[position].id: proof_to_string(proof) for position, proof in self.tree.iter_proofs() }
+
+        # When / Then
+        for leaf in self.leaves:
+            self.verify(leaf, proofs[leaf.id])
+
+    def test_tampered_leaf_balances(self):
+        # Given
+        leaf = Leaf('user-3', dict({'BTC': '4.5'}))
+
+        # When / Then
+        with self.assertRaises(Exception):
+            self.verify(leaf, proof_to_string(self.tree.get_proof('user-3')))
+
+    def test_tampered_last_step_after_known_nodes(self):
+        # Given
+        proof = self.tree.get_proof('user-3')
+        self.verify(self.leaves[3], proof_to_string(proof))
+        tampered = proof_to_string(proof[:-1])[:-1] + f",{{{proof[-1].side.value},{proof[-1].hash.hex()},BTC:1}}]"
+
+        # When / Then
+        with self.assertRaises(Exception):
+            self.verify(self.leaves[3], tampered)
+
+class BulkVerificationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.leaves = [Leaf(f'user-{i}', dict({'BTC': f'{i}.5'})) for i in range(11)]
+        self.leaves.append(Leaf('user\nwith a new line', dict({'ETH': '2'})))
+        self.tree = MerkleSumTree(self.leaves, salt = 'audit')
+        root = self.tree.get_root()
+        self.variables = dict({ 'root_hash': root.hash.hex(), 'root_balances': root.encode_balances(), 'hash_algorithm': 'sha256' })
+
+    def write_proofs(self) -> io.StringIO:
+        file = io.StringIO()
+        writer = csv.writer(file)
+        writer.writerow(['id', 'balances', 'proof', 'audit_id'])
+        for position, proof in self.tree.iter_proofs():
+            leaf = self.leaves[position]
+            writer.writerow([leaf.id, self.tree.get_leaf(leaf.id).encode_balances(), proof_to_string(proof), 'audit'])
+
+        return file
+
+    def test_trailing_blank_line(self):
+        # Given
+        file = self.write_proofs()
+        file.write('\n')
+        file.seek(0)
+
+        # When
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            failed_count = verify_bulk(file, self.variables, 1)
+
+        # Then
+        self.assertEqual(failed_count, 0)
+        self.assertIn(f"Verified proofs: {len(self.leaves)}", output.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,16 @@
 import csv
-from lib.merkle import verify_merkle_proof_from_leaf, to_decimal_balance, Node, ProofStep, Side
+from lib.merkle import verify_merkle_proof_from_leaf, from_units_balance, decode_proof, Node, ProofStep, Side
+from lib.balance import decode_balance_units
+from lib.verification import ProofVerifier
+from lib.binary_proof import CurrencyDictionary
+from decimal import Decimal
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Optional
 import argparse
+import base64
+import sys
 import re
 import json
 import hashlib
@@ -22,46 +32,165 @@ def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help='Relative path to the input file', required = True)
     parser.add_argument('-r', '--root', help='Relative path to json file with needed root data and hash algorithm', required = True)
+    parser.add_argument('-b', '--bulk', action='store_true', help='Verifies all the proofs of the input without the interactive output and prints a summary')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes used to verify the proofs in bulk mode')
 
     args = parser.parse_args()
 
-    return args.input, args.root
+    return args.input, args.root, args.bulk, args.workers
 
-def decode_balance(balance_str: str) -> dict[str, str]:
-    new_balance_list: list[tuple[str, str]] = []
+def decode_balance(balance_str: str) -> dict[str, Decimal]:
+    return from_units_balance(decode_balance_units(balance_str))
 
-    # If leaf has no balances then return an empty dict
-    if (balance_str == ""): return dict()
+'''
+    Gets the currency dictionary of the binary proofs of an audit from its root balances.
+'''
+def get_currency_dictionary(root_balances: str) -> CurrencyDictionary:
+    return CurrencyDictionary(balance.split(':')[0] for balance in root_balances.split('|') if balance)
 
-    balance_list_splitted = balance_str.split('|')
-    for balance in balance_list_splitted:
-        splitted_balance = balance.split(':')
-        if float(splitted_balance[1]) < 0: raise Exception("User balance must be positive")
+def is_binary_proof(proof_str: str) -> bool:
+    return not proof_str.startswith('[')
 
-        new_balance_list.append((splitted_balance[0], splitted_balance[1]))
+'''
+    Parses a proof, either stringified or a binary proof encoded in base64.
+'''
+def to_proofstep_list(proof_list_str: str, dictionary: CurrencyDictionary) -> list[ProofStep]:
+    if is_binary_proof(proof_list_str):
+        return decode_proof(base64.b64decode(proof_list_str, validate = True), dictionary)
 
-    filtered_balance_list = list(filter(lambda balance: not float(balance[1]) == 0, new_balance_list))
-    return { balance[0]: balance[1] for balance in filtered_balance_list }
-
-def to_proofstep_list(proof_list_str: str) -> list[ProofStep]:
     proof_list = list(map(lambda proof_step: proof_step.split(','), re.findall(r'\{(.*?)\}', proof_list_str)))
-    return [ProofStep(Side[proof[0]], bytes.fromhex(proof[1]), to_decimal_balance(decode_balance(proof[2]))) for proof in proof_list]
+    return [ProofStep(Side[proof[0]], bytes.fromhex(proof[1]), decode_balance(proof[2])) for proof in proof_list]
+
+def print_step(step: int, node: Node):
+    print(f"Step {step}, hash: {node.hash.hex()}")
 
 def get_variables(filename: str):
     with open(filename) as f:
         return json.load(f)
 
+BULK_CHUNK_SIZE = 10000
+MAX_REPORTED_IDS = 10
+
+verifier: Optional[ProofVerifier] = None
+columns: Optional[list[int]] = None
+
+def init_bulk_verifier(variable_dict: dict, header: list[str]):
+    global verifier, columns
+    verifier = ProofVerifier(
+        bytes.fromhex(variable_dict['root_hash']),
+        decode_balance_units(variable_dict['root_balances']),
+        variable_dict['hash_algorithm'],
+        dictionary = get_currency_dictionary(variable_dict['root_balances'])
+    )
+    columns = [header.index(name) for name in ['id', 'balances', 'proof', 'audit_id']]
+
+'''
+    Verifies a chunk of rows of the input, returning the number of rows and the id and error of each failed row.
+    Empty rows, such as a blank line at the end of the file, are skipped and not counted.
+'''
+def verify_chunk(rows: list[list[str]]) -> tuple[int, list[tuple[str, str]]]:
+    count = 0
+    failures = []
+
+    for row in rows:
+        if not row:
+            continue
+
+        count += 1
+        id = row[columns[0]].strip() if len(row) > columns[0] else ''
+        try:
+            balances, proof, audit_id = [row[column].strip() for column in columns[1:]]
+            leaf_hash = verifier.hash_function(str.encode(audit_id + id)).digest()
+            if is_binary_proof(proof):
+                verifier.verify_binary(leaf_hash, decode_balance_units(balances), base64.b64decode(proof, validate = True))
+            else:
+                verifier.verify(leaf_hash, decode_balance_units(balances), proof)
+        except Exception as e:
+            failures.append((id, str(e) or type(e).__name__))
+
+    return count, failures
+
+'''
+    Splits the rows of a csv reader in chunks. The rows are parsed by the reader, so quoted fields
+    spanning several lines stay in a single row.
+'''
+def read_chunks(reader, chunk_size: int):
+    while True:
+        chunk = list(islice(reader, chunk_size))
+        if len(chunk) == 0: return
+
+        yield chunk
+
+'''
+    Verifies every row of the input (a csv file with a header) splitting them in chunks among a pool of workers,
+    and prints a summary. At most two chunks per worker are read ahead, so the input is never fully held in memory.
+    Returns the number of failed proofs.
+'''
+def verify_bulk(file, variable_dict: dict, workers: int) -> int:
+    start = time.perf_counter()
+    reader = csv.reader(file)
+    header = [name.strip() for name in next(reader)]
+    verified_count = 0
+    errors = Counter()
+    failed_ids = []
+
+    def add_result(result: tuple[int, list[tuple[str, str]]]):
+        nonlocal verified_count
+        count, failures = result
+        verified_count += count - len(failures)
+
+        for id, error in failures:
+            errors[error] += 1
+            if len(failed_ids) < MAX_REPORTED_IDS:
+                failed_ids.append(id)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers, initializer = init_bulk_verifier, initargs = (variable_dict, header)) as executor:
+            pending = deque()
+            for chunk in read_chunks(reader, BULK_CHUNK_SIZE):
+                pending.append(executor.submit(verify_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    add_result(pending.popleft().result())
+
+            while pending:
+                add_result(pending.popleft().result())
+    else:
+        init_bulk_verifier(variable_dict, header)
+        for chunk in read_chunks(reader, BULK_CHUNK_SIZE):
+            add_result(verify_chunk(chunk))
+
+    elapsed = time.perf_counter() - start
+    failed_count = sum(errors.values())
+    total = verified_count + failed_count
+
+    print(f"Verified proofs: {verified_count}")
+    print(f"Failed proofs: {failed_count}")
+    for error, count in errors.most_common():
+        print(f"  {error}: {count}")
+    if failed_ids:
+        print(f"First failed ids: {', '.join(failed_ids)}")
+    print(f"Elapsed time: {elapsed:.2f}s")
+    print(f"Throughput: {total / elapsed if elapsed > 0 else 0:.0f} proofs/s")
+
+    return failed_count
+
 done = False
 if __name__ == '__main__':
-    input_path, variables_path = parse_arguments()
+    input_path, variables_path, bulk, workers = parse_arguments()
 
     with open(input_path, 'r+') as file:
         variable_dict = get_variables(variables_path)
+
+        if bulk:
+            sys.exit(1 if verify_bulk(file, variable_dict, workers) > 0 else 0)
+
         reader = csv.DictReader(file)
 
         root_balances = variable_dict['root_balances']
         root_hash = variable_dict['root_hash']
         hash_function = getattr(hashlib, variable_dict['hash_algorithm'])
+        root_node = Node(bytes.fromhex(root_hash), decode_balance(root_balances))
+        dictionary = get_currency_dictionary(root_balances)
         
         for row in reader:
             # Expects file with header
@@ -70,8 +199,8 @@ if __name__ == '__main__':
             id = row['id'].strip()
             audit_id = row['audit_id'].strip()
             merkle_leaf_hash = hash_function(str.encode(audit_id + id)).digest().hex()
-            balances = to_decimal_balance(decode_balance(row['balances'].strip()))
-            proof = to_proofstep_list(row['proof'].strip())
+            balances = decode_balance(row['balances'].strip())
+            proof = to_proofstep_list(row['proof'].strip(), dictionary)
 
             try:
                 t = threading.Thread(target=animate)
@@ -82,9 +211,10 @@ if __name__ == '__main__':
                 print(f"User merkle leaf hash: {merkle_leaf_hash}\n")
 
                 obtained_hash, obtained_balances = verify_merkle_proof_from_leaf(
-                    Node(bytes.fromhex(root_hash), to_decimal_balance(decode_balance(root_balances))),
+                    root_node,
                     proof,
-                    Node(bytes.fromhex(merkle_leaf_hash), balances)
+                    Node(bytes.fromhex(merkle_leaf_hash), balances),
+                    on_step = print_step
                 )
 
                 print(f"\nObtained hash: \t{obtained_hash}")
@@ -0,0 +1,49 @@
+from lib.tree_check import check_tree_file
+import argparse
+import json
+import os
+import sys
+import time
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='Relative path to the tree file, the first output of main.py', required = True)
+    parser.add_argument('-r', '--root', help='Relative path to json file with needed root data and hash algorithm', required = True)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of processes used to check the tree')
+
+    args = parser.parse_args()
+
+    return args.input, args.root, args.workers
+
+if __name__ == '__main__':
+    input_path, root_path, workers = parse_arguments()
+
+    with open(root_path) as file:
+        variable_dict = json.load(file)
+
+    start = time.perf_counter()
+    checked_count = 0
+
+    def add_checked(count: int):
+        global checked_count
+        checked_count += count
+
+    try:
+        mismatch = check_tree_file(
+            input_path, bytes.fromhex(variable_dict['root_hash']), variable_dict['root_balances'],
+            variable_dict['hash_algorithm'], workers, add_checked
+        )
+    except Exception as e:
+        print(f"Malformed tree file: {e}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    print(f"Checked nodes: {checked_count}")
+    print(f"Elapsed time: {elapsed:.2f}s")
+    print(f"Throughput: {checked_count / elapsed if elapsed > 0 else 0:.0f} nodes/s")
+
+    if mismatch is not None:
+        print(f"First mismatch at node {mismatch.index}: {mismatch.message}")
+        sys.exit(1)
+
+    print("The tree is valid")